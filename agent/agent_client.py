@@ -6,17 +6,51 @@ into a schema-valid narrative. Keep low temperature and validate JSON before use
 
 This file deliberately contains only interfaces & TODOs.
 """
-from typing import Dict, Any, List
+import hashlib, threading
+from collections import OrderedDict
+from typing import Callable, Dict, Any, List, Optional, Tuple
+from meteo_chat import fastjson
 from tools.visualization.plot_utils import plot_point_series, plot_region_aggregate
 
+# Rendering dominates assemble latency; identical series (repeat chat queries)
+# reuse the encoded PNG. Keyed on a digest of the series so the memo holds no
+# copies of the raw data; only the (small) images stay alive.
+FIG_MEMO_SIZE = 64
+_fig_memo: "OrderedDict[bytes, str]" = OrderedDict()
+_fig_lock = threading.Lock()
+
+def _memo_b64(kind: str, variable: str, unit: str, arrays: Tuple[List[Any], ...], render: Callable[[], str]) -> str:
+    key = hashlib.blake2b(fastjson.dumps([kind, variable, unit, *arrays]).encode("utf-8"), digest_size=16).digest()
+    with _fig_lock:
+        hit = _fig_memo.get(key)
+        if hit is not None:
+            _fig_memo.move_to_end(key)
+            return hit
+    img_b64 = render()
+    with _fig_lock:
+        _fig_memo[key] = img_b64
+        while len(_fig_memo) > FIG_MEMO_SIZE:
+            _fig_memo.popitem(last=False)
+    return img_b64
+
+def _point_b64(variable: str, unit: str, times: List[str], values: List[Optional[float]]) -> str:
+    return _memo_b64("series", variable, unit, (times, values),
+                     lambda: plot_point_series(variable, unit, times, values))
+
+def _aggregate_b64(variable: str, unit: str, index: List[int],
+                   mean: List[Optional[float]], iqr: List[Optional[float]]) -> str:
+    return _memo_b64("aggregate", variable, unit, (index, mean, iqr),
+                     lambda: plot_region_aggregate(variable, unit, index, mean, iqr))
+
 def figures_from_execute(ex: Dict[str, Any]) -> List[Dict[str, str]]:
     figs: List[Dict[str, str]] = []
     for s in ex.get("series", []) or []:
-        img_b64 = plot_point_series(s["variable"], s.get("unit",""), s.get("times", []), s.get("values", []))
+        img_b64 = _point_b64(s["variable"], s.get("unit",""), s.get("times", []), s.get("values", []))
         figs.append({"variable": s["variable"], "caption": f"{s['variable']} time series", "img_b64": img_b64})
     for a in ex.get("aggregates", []) or []:
         agg = a.get("aggregation", {})
-        img_b64 = plot_region_aggregate(a["variable"], a.get("unit",""), agg.get("index", []), agg.get("mean", []), agg.get("iqr", []))
+        img_b64 = _aggregate_b64(a["variable"], a.get("unit",""), agg.get("index", []),
+                                 agg.get("mean", []), agg.get("iqr", []))
         figs.append({"variable": a["variable"], "caption": f"{a['variable']} mean±IQR (region)", "img_b64": img_b64})
     # Climatology blocks are multi-panel; keep it simple for now.
     return figs
@@ -1,18 +1,31 @@
 # agent/infer_writer.py
-import os, json, re
-from typing import Dict, Any, Tuple
+import os, json
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import AutoTokenizer, AutoModelForCausalLM, StaticCache, DynamicCache
 from peft import PeftModel
 
 BASE   = os.getenv("BASE_MODEL", "Qwen/Qwen2.5-1.5B-Instruct")
-ADAPT  = os.getenv("LORA_DIR", "artifacts/adapter")
+ADAPT  = os.getenv("LORA_DIR", str(Path(__file__).resolve().parents[1] / "artifacts" / "adapter"))
 SYSTEM = "You must output only JSON that matches agent/schema/response_schema.json."
+PREFIX = f"<s>[SYSTEM]{SYSTEM}\n[USER]"  # identical for every request; its KV is prefilled once
+SUFFIX = "\n[ASSISTANT]"
+TORCH_COMPILE = os.getenv("TORCH_COMPILE", "1") == "1"
+MAX_CACHE_LEN = int(os.getenv("MAX_CACHE_LEN", "2048"))  # prompt + new tokens
+# "sdpa" fuses QK/softmax/V on every device; set "flash_attention_2" on CUDA if flash-attn is installed
+ATTN_IMPL = os.getenv("ATTN_IMPL", "sdpa")
+os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", str(Path(ADAPT).parent / "inductor_cache"))
 
 # Lazy globals to avoid reload between Streamlit reruns
 _tokenizer = None
 _model     = None
 _device    = None
+_prefix_ids = None  # token ids of PREFIX
+_ones       = None  # (1, MAX_CACHE_LEN) attention mask, sliced per request
+_prefix_kv  = None  # KV cache prefilled with PREFIX; template, never mutated
+_work_kv    = None  # preallocated StaticCache each request runs in (prefix slots copied in)
+_work_used  = 0     # slots of _work_kv the last request may have written
 
 def _device_dtype() -> Tuple[str, torch.dtype]:
     use_cuda = torch.cuda.is_available()
@@ -22,46 +35,185 @@ def _device_dtype() -> Tuple[str, torch.dtype]:
     return device, dtype
 
 def _load_once():
-    global _tokenizer, _model, _device
+    global _tokenizer, _model, _device, _prefix_ids, _ones, _prefix_kv, _work_kv, _work_used
     if _model is not None:
         return
     _device, dtype = _device_dtype()
     _tokenizer = AutoTokenizer.from_pretrained(BASE, use_fast=True)
     if _tokenizer.pad_token is None:
         _tokenizer.pad_token = _tokenizer.eos_token
-    base = AutoModelForCausalLM.from_pretrained(BASE, torch_dtype=dtype)
-    model = PeftModel.from_pretrained(base, ADAPT)
+    base = AutoModelForCausalLM.from_pretrained(BASE, torch_dtype=dtype, attn_implementation=ATTN_IMPL)
+    model = PeftModel.from_pretrained(base, ADAPT).merge_and_unload()  # fold LoRA into weights
     model.to(_device)
     model.eval()
     model.config.use_cache = True
     _model = model  # set global
+    _prefix_ids = _tokenizer(PREFIX, return_tensors="pt").input_ids.to(_device)
+    _ones = torch.ones((1, MAX_CACHE_LEN), dtype=torch.long, device=_device)
+    _prefix_kv = _prefill_prefix(dtype)
+    if isinstance(_prefix_kv, StaticCache):
+        _work_kv, _work_used = _prefill_prefix(dtype), _prefix_ids.shape[1]
+    if TORCH_COMPILE:
+        _compile(model)
+
+def _prefill_prefix(dtype: torch.dtype):
+    """Run the fixed PREFIX through the model once and keep its KV cache as a template."""
+    try:
+        cache = StaticCache(config=_model.config, max_batch_size=1, max_cache_len=MAX_CACHE_LEN,
+                            device=_device, dtype=dtype)
+    except Exception as e:
+        print(f"[infer_writer] StaticCache unavailable, using dynamic cache: {e}")
+        cache = DynamicCache()
+    n = _prefix_ids.shape[1]
+    with torch.inference_mode():
+        _model(input_ids=_prefix_ids, past_key_values=cache, use_cache=True,
+               cache_position=torch.arange(n, device=_device))
+    return cache
+
+def _compile(model) -> None:
+    """torch.compile the HF forward that generate() drives; stay eager on failure."""
+    target = model.get_base_model() if hasattr(model, "get_base_model") else model
+    try:
+        # same inference_mode context as write_answer, or the compiled graph slows down
+        with torch.inference_mode():
+            target.forward = torch.compile(target.forward, mode="reduce-overhead", fullgraph=False)
+            _generate(_encode("{}"), max_new_tokens=4)
+    except Exception as e:
+        print(f"[infer_writer] torch.compile failed, using eager: {e}")
+        target.__dict__.pop("forward", None)
+
+def _find_json(s: str) -> Optional[str]:
+    """
+    Single pass over s returning the first balanced {...} block (string-aware,
+    so braces inside JSON strings don't count). Linear time, no regex backtracking.
+    """
+    depth, start, in_str, esc = 0, -1, False, False
+    for i, c in enumerate(s):
+        if in_str:
+            if esc:
+                esc = False
+            elif c == "\\":
+                esc = True
+            elif c == '"':
+                in_str = False
+        elif c == '"':
+            in_str = depth > 0
+        elif c == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif c == "}" and depth > 0:
+            depth -= 1
+            if depth == 0:
+                return s[start:i + 1]
+    return None
 
 def _extract_json(s: str) -> Dict[str, Any]:
     s = s.strip()
     try:
         return json.loads(s)
     except Exception:
-        m = re.search(r"\{(?:.|\n)*?\}", s)
-        if m:
+        block = _find_json(s)
+        if block:
             try:
-                return json.loads(m.group(0))
+                return json.loads(block)
             except Exception:
                 pass
     # minimal valid schema fallback
     return {"title":"", "answer":"", "key_numbers":[], "figures":[], "method":"", "citations":[], "limitations":[], "suggested_followups":[]}
 
+def _encode(user: str) -> Dict[str, torch.Tensor]:
+    """The whole prompt tokenized as one string, as in training (BPE merges across both joins)."""
+    ids = _tokenizer(f"{PREFIX}{user}{SUFFIX}", return_tensors="pt").input_ids.to(_device)
+    n = ids.shape[1]
+    mask = _ones[:, :n] if n <= MAX_CACHE_LEN else torch.ones_like(ids)
+    return {"input_ids": ids, "attention_mask": mask}
+
+def _kv_layers(cache) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+    """(keys, values) per layer, for both transformers cache layouts."""
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    return list(zip(cache.key_cache, cache.value_cache))
+
+def _shared_prefix_len(ids: torch.Tensor) -> int:
+    """Leading ids identical to the prefilled PREFIX; only those KV slots can be reused."""
+    p = min(_prefix_ids.shape[1], ids.shape[1] - 1)  # leave generate() at least one token to prefill
+    same = (ids[0, :p] == _prefix_ids[0, :p]).int()
+    return int(same.cumprod(0).sum())
+
+def _prefix_cache(ids: torch.Tensor, max_new_tokens: int):
+    """
+    A cache holding the first m prefix slots (m = _shared_prefix_len), or None for a full prefill.
+    Runs in the preallocated _work_kv when the request fits: only the m prefix slots are copied
+    in and the slots the previous request wrote are cleared. Otherwise a prefix-length DynamicCache.
+    """
+    global _work_used
+    m = _shared_prefix_len(ids) if _prefix_kv is not None else 0
+    if m == 0:
+        return None
+    n = ids.shape[1]
+    if _work_kv is not None and n + max_new_tokens <= MAX_CACHE_LEN:
+        for (wk, wv), (tk, tv) in zip(_kv_layers(_work_kv), _kv_layers(_prefix_kv)):
+            wk[:, :, :m] = tk[:, :, :m]
+            wv[:, :, :m] = tv[:, :, :m]
+            # StaticCache counts filled slots as non-zero ones
+            wk[:, :, m:_work_used].zero_()
+            wv[:, :, m:_work_used].zero_()
+        _work_used = n + max_new_tokens
+        return _work_kv
+    cache = DynamicCache()
+    for i, (tk, tv) in enumerate(_kv_layers(_prefix_kv)):
+        cache.update(tk[:, :, :m].clone(), tv[:, :, :m].clone(), i)
+    return cache
+
+def _generate(enc, max_new_tokens: int):
+    """Greedy generate; generate() only prefills the tokens past the reused prefix slots."""
+    kwargs = {}
+    cache = _prefix_cache(enc["input_ids"], max_new_tokens)
+    if cache is not None:
+        kwargs["past_key_values"] = cache
+    return _model.generate(
+        **enc,
+        **kwargs,
+        do_sample=False,
+        max_new_tokens=max_new_tokens,
+        eos_token_id=_tokenizer.eos_token_id
+    )
+
 @torch.inference_mode()
 def write_answer(input_obj: Dict[str, Any], max_new_tokens: int = 220) -> Dict[str, Any]:
     _load_once()
     user = json.dumps(input_obj, ensure_ascii=False)
-    prompt = f"<s>[SYSTEM]{SYSTEM}\n[USER]{user}\n[ASSISTANT]"
-    enc = _tokenizer(prompt, return_tensors="pt").to(_device)
+    enc = _encode(user)
+    out = _generate(enc, max_new_tokens)
+    # decode only the completion, not the echoed prompt
+    new_tokens = out[0, enc["input_ids"].shape[1]:]
+    tail = _tokenizer.decode(new_tokens, skip_special_tokens=True)
+    return _extract_json(tail)
+
+@torch.inference_mode()
+def write_answers_batch(batch: List[Dict[str, Any]], max_new_tokens: int = 220) -> List[Dict[str, Any]]:
+    """
+    Same as write_answer over several inputs with one left-padded generate().
+    The prefix KV cache is batch-1 and position-aligned, so it isn't used here.
+    """
+    _load_once()
+    if not batch:
+        return []
+    rows = [_encode(json.dumps(obj, ensure_ascii=False))["input_ids"][0] for obj in batch]
+    width = max(r.shape[0] for r in rows)
+    ids = torch.full((len(rows), width), _tokenizer.pad_token_id, dtype=torch.long, device=_device)
+    mask = torch.zeros((len(rows), width), dtype=torch.long, device=_device)
+    for i, r in enumerate(rows):
+        ids[i, width - r.shape[0]:] = r
+        mask[i, width - r.shape[0]:] = 1
     out = _model.generate(
-        **enc,
+        input_ids=ids,
+        attention_mask=mask,
         do_sample=False,
         max_new_tokens=max_new_tokens,
-        eos_token_id=_tokenizer.eos_token_id
+        eos_token_id=_tokenizer.eos_token_id,
+        pad_token_id=_tokenizer.pad_token_id
     )
-    text = _tokenizer.decode(out[0], skip_special_tokens=False)
-    tail = text.split("[ASSISTANT]", 1)[-1]
-    return _extract_json(tail)
\ No newline at end of file
+    tails = _tokenizer.batch_decode(out[:, width:], skip_special_tokens=True)
+    return [_extract_json(t) for t in tails]
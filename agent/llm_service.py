@@ -1,11 +1,15 @@
-# weatherai/agent/llm_service.py
+# agent/llm_service.py
 
 from pathlib import Path
+from typing import List
+import asyncio
+import json
 import os
+import threading
 import torch
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from fastapi.responses import JSONResponse, StreamingResponse
+from transformers import AutoModelForCausalLM, AutoTokenizer, TextIteratorStreamer
 from peft import PeftModel
 
 app = FastAPI(title="WeatherAI LLM Service")
@@ -14,21 +18,71 @@ app = FastAPI(title="WeatherAI LLM Service")
 # Paths & runtime configuration
 # -------------------------------
 
-# Resolve adapter dir relative to this file, so it works from any CWD
-ADAPTER_PATH = Path(__file__).resolve().parents[1] / "artifacts" / "adapter"
+# ADAPTER_PATH env wins; default resolves relative to this file, so it works from any CWD
+ADAPTER_PATH = Path(
+    os.getenv("ADAPTER_PATH") or Path(__file__).resolve().parents[1] / "artifacts" / "adapter"
+)
 
 print(f"[llm_service] Using adapter dir: {ADAPTER_PATH}")
 
 BASE_MODEL = os.getenv("BASE_MODEL", "Qwen/Qwen2.5-1.5B-Instruct")
 TOKENIZER_PATH = os.getenv("TOKENIZER_PATH", BASE_MODEL)
 
-# For portability: always use CPU + float32
+_DTYPES = {"float32": torch.float32, "bfloat16": torch.bfloat16, "float16": torch.float16}
+
+
+def _cpu_dtype() -> torch.dtype:
+    """
+    bfloat16 on CPUs with native bf16 matmul (AVX512-BF16 / AMX), float32 elsewhere.
+    LLM_DTYPE=float32|bfloat16|float16 overrides the detection; anything else is
+    ignored with a warning.
+    """
+    forced = (os.getenv("LLM_DTYPE") or "").strip().lower()
+    if forced in _DTYPES:
+        return _DTYPES[forced]
+    if forced:
+        print(f"[llm_service] Ignoring LLM_DTYPE={forced!r} (expected one of {', '.join(_DTYPES)}); auto-detecting.")
+    for probe in ("_is_avx512_bf16_supported", "_is_amx_tile_supported"):
+        check = getattr(torch.cpu, probe, None)
+        try:
+            if check is not None and check():
+                return torch.bfloat16
+        except Exception:
+            pass
+    return torch.float32
+
+
+# For portability: always run on CPU; bf16 only where the hardware has it
 DEVICE = "cpu"
-DTYPE = torch.float32
+DTYPE = _cpu_dtype()
 
 MAX_NEW_TOKENS = int(os.getenv("MAX_NEW_TOKENS", "256"))
 TEMPERATURE = float(os.getenv("TEMPERATURE", "0.2"))
 TOP_P = float(os.getenv("TOP_P", "0.95"))
+# Sampling knobs are only passed when sampling; greedy decode then builds no
+# temperature/top-p logits warpers at all.
+if TEMPERATURE > 0:
+    GEN_KWARGS = dict(do_sample=True, temperature=TEMPERATURE, top_p=TOP_P)
+else:
+    GEN_KWARGS = dict(do_sample=False, num_beams=1, use_cache=True)
+
+# Micro-batching: requests arriving within BATCH_WAIT_MS share one generate() (up to BATCH_MAX)
+BATCH_MAX = int(os.getenv("BATCH_MAX", "8"))
+BATCH_WAIT_MS = float(os.getenv("BATCH_WAIT_MS", "10"))
+# Fused attention kernel; "sdpa" is the CPU-friendly choice, "eager" to disable
+ATTN_IMPL = os.getenv("ATTN_IMPL", "sdpa")
+
+# torch.compile the decode step (set TORCH_COMPILE=0 to stay eager)
+TORCH_COMPILE = os.getenv("TORCH_COMPILE", "1") == "1"
+# TorchScript-trace the logits forward when torch.compile is off/unavailable
+TORCH_JIT = os.getenv("TORCH_JIT", "1") == "1"
+# INT8 weight-only quantization of the base model via torchao (skipped if not installed)
+INT8_WEIGHT_ONLY = os.getenv("INT8_WEIGHT_ONLY", "1") == "1"
+# Persist Inductor artifacts so the compile warm-up is paid once, not per process
+os.environ.setdefault(
+    "TORCHINDUCTOR_CACHE_DIR",
+    str(Path(__file__).resolve().parents[1] / "artifacts" / "inductor_cache"),
+)
 
 # -------------------------------
 # Load base model + optional LoRA
@@ -36,15 +90,44 @@ TOP_P = float(os.getenv("TOP_P", "0.95"))
 
 print(f"[LLM] Loading base model: {BASE_MODEL}")
 tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_PATH, use_fast=True)
+if tokenizer.pad_token is None:
+    tokenizer.pad_token = tokenizer.eos_token
+tokenizer.padding_side = "left"  # batched decoder-only generation continues from the right edge
 
 base_model = AutoModelForCausalLM.from_pretrained(
     BASE_MODEL,
     torch_dtype=DTYPE,
-    device_map=None,   # IMPORTANT: no 'auto' -> no meta/offload
+    device_map={"": DEVICE},  # IMPORTANT: explicit single device, not 'auto' -> no meta/offload
+    low_cpu_mem_usage=True,   # stream weights in; no second full-size copy at load
+    attn_implementation=ATTN_IMPL,
 )
-base_model.to(DEVICE)
 base_model.eval()
 
+
+def _quantize_int8_weight_only(m) -> bool:
+    """
+    Weight-only INT8 (torchao): decode on CPU is bound by weight bandwidth, so
+    halving the bytes per step is the win. Deliberately not bitsandbytes int8,
+    which is slower than the float baseline for this model size.
+    """
+    try:
+        from torchao.quantization import quantize_
+        try:
+            from torchao.quantization import Int8WeightOnlyConfig
+            cfg = Int8WeightOnlyConfig()
+        except ImportError:  # older torchao
+            from torchao.quantization import int8_weight_only
+            cfg = int8_weight_only()
+    except ImportError:
+        print("[LLM] torchao not installed; skipping INT8 weight-only quantization.")
+        return False
+    try:
+        quantize_(m, cfg)
+        return True
+    except Exception as e:
+        print(f"[LLM] INT8 weight-only quantization failed: {e}")
+        return False
+
 model = base_model
 
 # Try to apply LoRA if adapter exists; otherwise fall back gracefully
@@ -55,11 +138,12 @@ if ADAPTER_PATH.exists() and (ADAPTER_PATH / "adapter_config.json").exists():
             base_model,
             str(ADAPTER_PATH),
             torch_dtype=DTYPE,
-            device_map=None,   # keep on CPU
-        )
-        model.to(DEVICE)
+        )  # LoRA layers are created on the base layers' device; no extra .to()
+        # No adapter hot-swapping here, so fold LoRA into the base weights:
+        # removes the extra low-rank matmuls on every target module per token.
+        model = model.merge_and_unload()
         model.eval()
-        print("[LLM] LoRA adapter loaded successfully.")
+        print("[LLM] LoRA adapter loaded and merged successfully.")
     except Exception as e:
         print(f"[LLM] Failed to load LoRA adapter: {e}")
         print("[LLM] Falling back to base model only.")
@@ -67,6 +151,178 @@ if ADAPTER_PATH.exists() and (ADAPTER_PATH / "adapter_config.json").exists():
 else:
     print("[LLM] No adapter found or incomplete; using base model only.")
 
+# Quantize after the merge: LoRA deltas can't be folded into int8 weights
+if INT8_WEIGHT_ONLY and _quantize_int8_weight_only(model):
+    print("[LLM] Model quantized to INT8 weight-only.")
+
+
+def _compile_forward(m):
+    """
+    Compile the underlying HF model's forward in place. generate() calls
+    self(...) on that module, so this is what actually runs per decode step
+    (wrapping the PeftModel itself would leave generate() eager).
+    """
+    target = m.get_base_model() if hasattr(m, "get_base_model") else m
+    target.forward = torch.compile(target.forward, mode="reduce-overhead", fullgraph=False)
+
+
+_compiled = False
+if TORCH_COMPILE:
+    try:
+        print("[LLM] Compiling model with torch.compile (first run may take a while)...")
+        # Compile + warm up under the same inference_mode that /generate uses,
+        # otherwise Inductor takes the slow version-counter path at runtime.
+        with torch.inference_mode():
+            _compile_forward(model)
+            warm = tokenizer("warmup", return_tensors="pt").to(DEVICE)
+            model.generate(**warm, **GEN_KWARGS, max_new_tokens=4)
+        _compiled = True
+        print("[LLM] torch.compile warm-up done.")
+    except Exception as e:
+        print(f"[LLM] torch.compile failed: {e}")
+        print("[LLM] Falling back to eager mode.")
+        target = model.get_base_model() if hasattr(model, "get_base_model") else model
+        target.__dict__.pop("forward", None)  # drop the compiled override
+
+
+
+class _LogitsOnly(torch.nn.Module):
+    """Tensor-in/tensor-out view of the model that torch.jit.trace can capture."""
+
+    def __init__(self, m):
+        super().__init__()
+        self.m = m
+
+    def forward(self, input_ids, attention_mask):
+        return self.m(input_ids=input_ids, attention_mask=attention_mask,
+                      use_cache=False, return_dict=False)[0]
+
+
+def _trace_logits(m):
+    """
+    AOT fallback for runtimes without Inductor (e.g. MPS, older CPU builds):
+    trace + freeze the no-cache forward. Only used for single-forward work
+    (the prefill-only path); multi-token decode stays on generate() + KV cache.
+    Returns None if tracing fails or the trace got specialized to one shape.
+    """
+    wrapper = _LogitsOnly(m).eval()
+    probe = tokenizer(["warmup"], return_tensors="pt").to(DEVICE)
+    check = tokenizer(["a longer prompt to check the trace is not shape-specialized"],
+                      return_tensors="pt").to(DEVICE)
+    try:
+        with torch.no_grad():
+            traced = torch.jit.trace(wrapper, (probe["input_ids"], probe["attention_mask"]),
+                                     strict=False, check_trace=False)
+            traced = torch.jit.optimize_for_inference(traced)
+            got = traced(check["input_ids"], check["attention_mask"])
+            want = wrapper(check["input_ids"], check["attention_mask"])
+        if got.shape != want.shape or not torch.allclose(got.float(), want.float(), atol=1e-2, rtol=1e-2):
+            print("[LLM] torch.jit trace does not generalize across lengths; not using it.")
+            return None
+        return traced
+    except Exception as e:
+        print(f"[LLM] torch.jit trace failed: {e}")
+        return None
+
+
+_traced = None
+if not _compiled and TORCH_JIT:
+    _traced = _trace_logits(model)
+    if _traced is not None:
+        print("[LLM] Using torch.jit traced forward for prefill-only requests.")
+
+# -------------------------------
+# Micro-batching
+# -------------------------------
+
+_queue: "asyncio.Queue | None" = None
+_worker: "asyncio.Task | None" = None
+# One generate() at a time: the batch worker and /generate_stream share the model
+_model_lock = threading.Lock()
+
+
+def _sample_next(logits: torch.Tensor) -> torch.Tensor:
+    """Pick one token per row from last-position logits (greedy, or temperature + top-p)."""
+    if TEMPERATURE <= 0:
+        return logits.argmax(dim=-1)
+    probs = torch.softmax(logits.float() / TEMPERATURE, dim=-1)
+    sorted_p, sorted_ix = probs.sort(dim=-1, descending=True)
+    keep = sorted_p.cumsum(dim=-1) - sorted_p < TOP_P  # always keeps the top token
+    sorted_p = sorted_p * keep
+    choice = torch.multinomial(sorted_p / sorted_p.sum(dim=-1, keepdim=True), 1)
+    return sorted_ix.gather(-1, choice).squeeze(-1)
+
+
+def _prefill_only(inputs) -> torch.Tensor:
+    """
+    max_new_tokens == 1: a single forward pass is the whole job, so skip
+    generate()'s loop and KV-cache allocation entirely.
+    """
+    if _traced is not None:
+        logits = _traced(inputs["input_ids"], inputs["attention_mask"])[:, -1, :]
+    else:
+        logits = model(**inputs, use_cache=False).logits[:, -1, :]
+    return torch.cat([inputs["input_ids"], _sample_next(logits)[:, None]], dim=1)
+
+
+def _generate_batch(prompts: List[str], max_new_tokens: int) -> List[str]:
+    """One left-padded generate() over all prompts; returns one text per prompt."""
+    inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(DEVICE)
+    with _model_lock, torch.inference_mode():
+        if max_new_tokens == 1:
+            out = _prefill_only(inputs)
+        else:
+            out = model.generate(
+                **inputs,
+                **GEN_KWARGS,
+                max_new_tokens=max_new_tokens,
+                pad_token_id=tokenizer.pad_token_id,
+            )
+    return [tokenizer.decode(row, skip_special_tokens=True).strip() for row in out]
+
+
+async def _batch_worker():
+    """
+    Collect queued prompts for up to BATCH_WAIT_MS / BATCH_MAX, run them together.
+    Requests with different max_new_tokens are run as separate sub-batches.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _queue.get()]
+        deadline = loop.time() + BATCH_WAIT_MS / 1000.0
+        while len(batch) < BATCH_MAX:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        groups = {}
+        for prompt, n_new, fut in batch:
+            groups.setdefault(n_new, []).append((prompt, fut))
+        for n_new, items in groups.items():
+            prompts = [p for p, _ in items]
+            try:
+                # generate() blocks; keep the event loop free to accept the next batch
+                texts = await loop.run_in_executor(None, _generate_batch, prompts, n_new)
+            except Exception as e:
+                for _, fut in items:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for (_, fut), text in zip(items, texts):
+                if not fut.done():
+                    fut.set_result(text)
+
+
+@app.on_event("startup")
+async def _start_batch_worker():
+    global _queue, _worker
+    _queue = asyncio.Queue()
+    _worker = asyncio.create_task(_batch_worker())
+
 # -------------------------------
 # Endpoints
 # -------------------------------
@@ -82,6 +338,29 @@ def health():
     }
 
 
+def _requested_new_tokens(data: dict) -> int:
+    """
+    max_new_tokens from the request body, clamped to [1, MAX_NEW_TOKENS].
+    Raises ValueError when it is not an integer (the endpoints answer 422).
+    """
+    raw = data.get("max_new_tokens")
+    if raw is None:
+        return MAX_NEW_TOKENS
+    if isinstance(raw, bool) or not isinstance(raw, (int, float, str)):
+        raise ValueError("max_new_tokens must be an integer")
+    if isinstance(raw, float) and not raw.is_integer():  # int() would silently truncate 3.7
+        raise ValueError("max_new_tokens must be an integer")
+    try:
+        n = int(raw)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError("max_new_tokens must be an integer") from None
+    return max(1, min(n, MAX_NEW_TOKENS))
+
+
+def _bad_request(e: Exception) -> JSONResponse:
+    return JSONResponse(status_code=422, content={"error": str(e)})
+
+
 @app.post("/generate")
 async def generate(req: Request):
     data = await req.json()
@@ -89,19 +368,64 @@ async def generate(req: Request):
     if not prompt:
         return JSONResponse(content={"text": ""})
 
-    inputs = tokenizer(prompt, return_tensors="pt").to(DEVICE)
+    try:
+        max_new_tokens = _requested_new_tokens(data)
+    except ValueError as e:
+        return _bad_request(e)
+
+    fut = asyncio.get_running_loop().create_future()
+    await _queue.put((prompt, max_new_tokens, fut))
+    text = await fut
+    return {"text": text}
+
+
+
+@app.post("/generate_stream")
+async def generate_stream(req: Request):
+    """
+    Server-sent events: one `data: {"token": ...}` event per decoded chunk of the
+    completion (prompt not echoed), then `data: [DONE]`. If generation fails the
+    stream ends with `event: error` / `data: {"error": ...}` instead of [DONE].
+    Runs outside the micro-batcher so tokens can be flushed as soon as they exist.
+    """
+    data = await req.json()
+    prompt = (data.get("prompt") or "").strip()
+    try:
+        max_new_tokens = _requested_new_tokens(data)
+    except ValueError as e:
+        return _bad_request(e)
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    failure: List[str] = []
+
+    def _run():
+        try:
+            inputs = tokenizer(prompt, return_tensors="pt").to(DEVICE)
+            with _model_lock, torch.inference_mode():
+                model.generate(**inputs, **GEN_KWARGS, max_new_tokens=max_new_tokens,
+                               pad_token_id=tokenizer.pad_token_id, streamer=streamer)
+        except Exception as e:
+            print(f"[LLM] stream generation failed: {e}")
+            failure.append(str(e) or type(e).__name__)
+            streamer.end()  # unblock the consumer; set before end() so _events sees it
 
-    with torch.no_grad():
-        out = model.generate(
-            **inputs,
-            max_new_tokens=MAX_NEW_TOKENS,
-            temperature=TEMPERATURE,
-            top_p=TOP_P,
-            do_sample=True if TEMPERATURE > 0 else False,
-        )
+    def _events():
+        for tok in streamer:
+            if tok:
+                yield f"data: {json.dumps({'token': tok})}\n\n"
+        if failure:
+            yield f"event: error\ndata: {json.dumps({'error': failure[0]})}\n\n"
+            return
+        yield "data: [DONE]\n\n"
 
-    text = tokenizer.decode(out[0], skip_special_tokens=True)
-    return {"text": text.strip()}
+    if prompt:
+        threading.Thread(target=_run, daemon=True).start()
+    else:
+        streamer.end()
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # -------------------------------
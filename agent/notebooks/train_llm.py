@@ -1,29 +1,35 @@
 """
 Tiny Writer LLM Fine-tune (LoRA, single-device, no-TRL)
 
-- Robust JSONL load (no pyarrow)
+- Robust JSONL load (orjson when installed, no pyarrow)
 - No TF/Flax/JAX
 - Single-device training (CPU/MPS/CUDA) — avoids device_map sharding bugs
 - Torch AdamW (no bitsandbytes)
 - Uses transformers.Trainer + PEFT LoRA
 
 Run:
-  pip install -U torch transformers peft datasets accelerate
+  pip install -U torch transformers peft datasets accelerate  # + orjson (optional, faster load)
   BASE_MODEL='Qwen/Qwen2.5-1.5B-Instruct' python agent/notebooks/train_llm.py
 """
 
-import os, json, random
+import os, sys, json, random, importlib.util
+from pathlib import Path
 from typing import Dict, Any, List
 os.environ["TRANSFORMERS_NO_TF"] = "1"
 os.environ["TRANSFORMERS_NO_FLAX"] = "1"
 os.environ["TRANSFORMERS_NO_JAX"] = "1"
 
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from meteo_chat import fastjson
 import torch
 from datasets import Dataset
 from transformers import (
-    AutoTokenizer, AutoModelForCausalLM, TrainingArguments, Trainer
+    AutoTokenizer, AutoModelForCausalLM, TrainingArguments, Trainer,
+    DataCollatorForLanguageModeling
 )
-from transformers.data.data_collator import default_data_collator
 from peft import LoraConfig, get_peft_model, TaskType
 
 # ---------------- Config ----------------
@@ -42,18 +48,21 @@ random.seed(SEED)
 
 # ---------------- Data (robust JSONL) ----------------
 def read_jsonl(path: str) -> List[Dict[str, Any]]:
+    # one binary read + split: no per-line readline()/decode/strip
+    with open(path, "rb") as f:
+        lines = f.read().split(b"\n")
     items: List[Dict[str, Any]] = []
-    with open(path, "r", encoding="utf-8") as f:
-        for ln, line in enumerate(f, 1):
-            s = line.strip()
-            if not s:
-                continue
-            try:
-                items.append(json.loads(s))
-            except Exception as e:
-                print(f"[skip line {ln}] {e}")
+    for ln, line in enumerate(lines, 1):
+        if not line or line.isspace():
+            continue
+        try:
+            items.append(fastjson.loads(line))  # tolerates surrounding whitespace / \r
+        except ValueError as e:  # orjson's and json's decode errors both subclass it
+            print(f"[skip line {ln}] {e}")
     return items
 
+# Kept on json.dumps: orjson's compact separators would change the prompt text
+# away from what infer_writer sends at inference time.
 def to_text(ex: Dict[str, Any]) -> str:
     sys = ex["system"]
     usr = json.dumps(ex["input"], ensure_ascii=False)
@@ -64,14 +73,21 @@ raw = read_jsonl(DATA_PATH)
 if not raw:
     raise SystemExit(f"Dataset empty: {DATA_PATH}")
 texts = [to_text(r) for r in raw]
-ds = Dataset.from_dict({"text": texts})
-print(f"Loaded {len(ds)} training examples from {DATA_PATH}")
+print(f"Loaded {len(texts)} training examples from {DATA_PATH}")
 
 # ---------------- Device & dtype ----------------
 use_cuda = torch.cuda.is_available()
 use_mps  = getattr(torch.backends, "mps", None) and torch.backends.mps.is_available()
 device   = "cuda" if use_cuda else ("mps" if use_mps else "cpu")
-dtype    = torch.float16 if (use_cuda or use_mps) else torch.float32
+use_bf16 = bool(use_cuda) and torch.cuda.is_bf16_supported()  # Ampere+: no fp16 loss scaling
+dtype    = torch.bfloat16 if use_bf16 else (torch.float16 if (use_cuda or use_mps) else torch.float32)
+# FlashAttention-2 on Ampere+ CUDA (sm_80+) when flash-attn is installed; SDPA otherwise (T4/V100, MPS, CPU)
+use_fa2  = bool(use_cuda) and torch.cuda.get_device_capability()[0] >= 8 and importlib.util.find_spec("flash_attn") is not None
+attn_impl = "flash_attention_2" if use_fa2 else "sdpa"
+if use_cuda:
+    # gradient checkpointing (below) frees the activation memory for twice the micro-batch;
+    # halve the accumulation so the effective batch (and LR schedule) stays the same
+    BATCH, GRAD_ACCUM = BATCH * 2, max(1, GRAD_ACCUM // 2)
 
 # ---------------- Tokenizer & Model ----------------
 tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL, use_fast=True)
@@ -81,9 +97,15 @@ if tokenizer.pad_token is None:
 model = AutoModelForCausalLM.from_pretrained(
     BASE_MODEL,
     torch_dtype=dtype,          # <- single dtype
+    attn_implementation=attn_impl,
 )  # no device_map here
 model.to(device)               # <- single device
 model.config.use_cache = False # <- needed when training/ckpt
+if use_cuda:
+    # trade recompute for activation memory (not on MPS: grad issues);
+    # inputs must require grad so checkpointed blocks backprop into LoRA
+    model.gradient_checkpointing_enable()
+    model.enable_input_require_grads()
 
 # ---------------- LoRA ----------------
 peft_cfg = LoraConfig(
@@ -95,22 +117,19 @@ model = get_peft_model(model, peft_cfg)
 model.train()  # ensure training mode
 
 # ---------------- Tokenization ----------------
-def tokenize_fn(batch):
-    tok = tokenizer(
-        batch["text"],
-        truncation=True,
-        max_length=MAX_SEQ_LEN,
-        padding="longest",   # pad in batch by collator
-        return_attention_mask=True
-    )
-    # causal LM: labels = input_ids
-    tok["labels"] = tok["input_ids"].copy()
-    return tok
-
-tok_ds = ds.map(tokenize_fn, batched=True, remove_columns=["text"])
-
-# Simple collator that leaves labels intact and pads consistently
-collator = default_data_collator
+# One batched call into the Rust fast tokenizer for the whole corpus; no padding
+# here — the collator pads each batch to its own longest row.
+enc = tokenizer(
+    texts,
+    truncation=True,
+    max_length=MAX_SEQ_LEN,
+    padding=False,
+    return_attention_mask=True
+)
+tok_ds = Dataset.from_dict({"input_ids": enc["input_ids"], "attention_mask": enc["attention_mask"]})
+
+# Dynamic padding; causal LM labels = input_ids with pad positions set to -100
+collator = DataCollatorForLanguageModeling(tokenizer, mlm=False)
 
 # ---------------- Training ----------------
 # Keep it simple & version-safe
@@ -125,11 +144,11 @@ args = TrainingArguments(
     logging_steps=10,
     save_strategy="epoch",
     optim="adamw_torch",
-    fp16=bool(use_cuda),  # fp16 only on CUDA; MPS runs float16 compute via dtype
-    bf16=False,
+    fp16=bool(use_cuda) and not use_bf16,  # fp16 only on pre-Ampere CUDA; MPS runs float16 compute via dtype
+    bf16=use_bf16,
     report_to=[],
     dataloader_pin_memory=False,
-    gradient_checkpointing=False,  # avoid MPS/grad issues
+    gradient_checkpointing=bool(use_cuda),  # CUDA only; avoid MPS/grad issues
 )
 
 trainer = Trainer(
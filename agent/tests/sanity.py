@@ -1,23 +1,44 @@
 # agent/test/sanity.py
-import json, sys
-from agent.infer_writer import write_answer
+import sys
+from meteo_chat import fastjson
+from agent.infer_writer import write_answers_batch
+
+BATCH = 8
+PROGRESS_EVERY = 200
+
+def _is_ok(out) -> bool:
+    has_title = bool(out.get("title"))
+    has_answer = bool(out.get("answer"))
+    cites_ok = isinstance(out.get("citations", []), list)
+    return has_title and has_answer and cites_ok
 
 def main():
     path = sys.argv[1] if len(sys.argv) > 1 else "data/train_full.nonempty.jsonl"
-    ok = bad = 0
-    with open(path, "r", encoding="utf-8") as f:
-        for i, line in enumerate(f, 1):
-            ex = json.loads(line)
-            out = write_answer(ex["input"])
-            has_title = bool(out.get("title"))
-            has_answer = bool(out.get("answer"))
-            cites_ok = isinstance(out.get("citations", []), list)
-            if has_title and has_answer and cites_ok:
+    ok = bad = i = 0
+    buf = []
+
+    def flush():
+        nonlocal ok, bad, i
+        for out in write_answers_batch(buf):
+            i += 1
+            if _is_ok(out):
                 ok += 1
             else:
                 bad += 1
-            if i % 20 == 0:
-                print(f"[{i}] ok={ok} bad={bad}")
+            if i % PROGRESS_EVERY == 0:
+                sys.stdout.write(f"[{i}] ok={ok} bad={bad}\n")
+                sys.stdout.flush()
+        buf.clear()
+
+    with open(path, "rb") as f:
+        for raw in f:
+            if raw.isspace():
+                continue
+            buf.append(fastjson.loads(raw)["input"])  # bytes in, no decode/strip
+            if len(buf) == BATCH:
+                flush()
+    if buf:
+        flush()
     print(f"✅ done: ok={ok} bad={bad}")
 
 if __name__ == "__main__":
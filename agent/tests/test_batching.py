@@ -0,0 +1,25 @@
+from meteo_chat.batching import build_batched_prompt, split_batched_reply
+
+
+def test_prompt_numbers_questions_and_ends_with_answer_marker():
+    p = build_batched_prompt("Place: Oslo", ["hi?", "wind?"])
+    assert "Q1: hi?\nQ2: wind?" in p
+    assert p.endswith("ASSISTANT (answer only):")
+
+
+def test_split_labeled_reply_any_order():
+    reply = "A2: Windy, 12 m/s.\nA1: Cold, -3 °C.\n"
+    assert split_batched_reply(reply, 2) == ["Cold, -3 °C.", "Windy, 12 m/s."]
+
+
+def test_missing_duplicate_and_out_of_range_labels():
+    reply = "A1: first\nA1: again\nA3: extra\n"
+    assert split_batched_reply(reply, 2) == ["first", None]
+    assert split_batched_reply("A1:\nA2: x", 2) == [None, "x"]
+
+
+def test_unlabeled_reply_is_not_attributed():
+    assert split_batched_reply("It is cold and windy.", 2) == [None, None]
+    assert split_batched_reply("", 1) == [None]
+    # a label mid-line is not a label
+    assert split_batched_reply("Answer A1: here", 1) == [None]
@@ -0,0 +1,25 @@
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("peft")
+
+from agent.infer_writer import _find_json
+
+
+def test_first_balanced_block_inside_prose():
+    assert _find_json('Sure! {"a": {"b": 1}} and {"c": 2}') == '{"a": {"b": 1}}'
+
+
+def test_braces_and_escaped_quotes_inside_strings():
+    s = 'x {"t": "a } b { c", "q": "say \\"}\\""} y'
+    assert _find_json(s) == '{"t": "a } b { c", "q": "say \\"}\\""}'
+
+
+def test_stray_quote_in_prose_does_not_open_a_string():
+    assert _find_json('He said "ok. {"a": 1}') == '{"a": 1}'
+
+
+def test_unbalanced_or_missing():
+    assert _find_json('{"a": 1') is None
+    assert _find_json("no json here") is None
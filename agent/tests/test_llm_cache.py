@@ -0,0 +1,71 @@
+import numpy as np
+
+from meteo_chat.llm_cache import LLMCache, salient_terms
+
+
+def _unit(*xs):
+    v = np.asarray(xs, dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+
+def test_salient_terms_numbers_and_aggregate_words():
+    nums, words = salient_terms("Max temperature on day 3, 12.5 km out?")
+    assert nums == ("3", "12.5")
+    assert words == {"max", "day"}
+    assert salient_terms("how windy is it") == ((), frozenset())
+
+
+def test_exact_question_hits_without_embedding(tmp_path):
+    c = LLMCache(str(tmp_path / "c.sqlite"))
+    c.put("ctx", "how windy is it?", "Breezy.")
+    assert c.get("ctx", "how windy is it?") == "Breezy."
+    assert c.get("ctx", "what's the wind like?") is None
+    assert c.get("other ctx", "how windy is it?") is None
+
+
+def test_semantic_hit_needs_threshold(tmp_path):
+    c = LLMCache(str(tmp_path / "c.sqlite"), threshold=0.95)
+    c.put("ctx", "how windy is it?", "Breezy.", _unit(1, 0, 0))
+    assert c.get("ctx", "what's the wind like?", _unit(1, 0.1, 0)) == "Breezy."   # cos ~0.995
+    assert c.get("ctx", "will it rain?", _unit(1, 1, 0)) is None                 # cos ~0.71
+
+
+def test_salient_mismatch_blocks_semantic_hit(tmp_path):
+    c = LLMCache(str(tmp_path / "c.sqlite"))
+    c.put("ctx", "max temperature?", "31 °C", _unit(1, 0, 0))
+    assert c.get("ctx", "min temperature?", _unit(1, 0, 0)) is None
+    assert c.get("ctx", "maximum temp on day 2?", _unit(1, 0, 0)) is None
+    assert c.get("ctx", "the max temperature?", _unit(1, 0, 0)) == "31 °C"
+
+
+def test_put_upserts_same_question(tmp_path):
+    c = LLMCache(str(tmp_path / "c.sqlite"))
+    c.put("ctx", "q", "first")
+    c.put("ctx", "q", "second")
+    assert c.get("ctx", "q") == "second"
+    assert c._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] == 1
+
+
+def test_expired_rows_are_ignored_and_pruned(tmp_path):
+    path = str(tmp_path / "c.sqlite")
+    c = LLMCache(path, ttl=60)
+    c.put("ctx", "old", "stale")
+    c.put("ctx", "new", "fresh")
+    with c._conn:
+        c._conn.execute("UPDATE llm_cache SET ts = ts - 120 WHERE question = 'old'")
+    assert c.get("ctx", "old") is None
+    assert c.get("ctx", "new") == "fresh"
+    reopened = LLMCache(path, ttl=60)  # prunes on open
+    assert reopened._conn.execute("SELECT question FROM llm_cache").fetchall() == [("new",)]
+
+
+def test_row_cap_drops_oldest(tmp_path):
+    path = str(tmp_path / "c.sqlite")
+    c = LLMCache(path)
+    for i in range(3):
+        c.put("ctx", f"q{i}", f"r{i}")
+        with c._conn:
+            c._conn.execute("UPDATE llm_cache SET ts = ts - ? WHERE question = ?", (10 * (3 - i), f"q{i}"))
+    capped = LLMCache(path, max_rows=2)
+    assert capped.get("ctx", "q0") is None
+    assert [capped.get("ctx", q) for q in ("q1", "q2")] == ["r1", "r2"]
@@ -0,0 +1,25 @@
+from meteo_chat.mcp_cache import MCPCache, payload_key
+
+
+def test_payload_key_ignores_dict_order():
+    assert payload_key("/plan_query", {"a": 1, "b": [1, 2]}) == payload_key("/plan_query", {"b": [1, 2], "a": 1})
+    assert payload_key("/plan_query", {"a": 1}) != payload_key("/execute_plan", {"a": 1})
+
+
+def test_round_trip_and_uncached_endpoint(tmp_path):
+    c = MCPCache(str(tmp_path / "m.sqlite"), ttls={"/resolve_location": 60})
+    c.put("/resolve_location", {"query": "Tokyo"}, {"lat": 35.7, "lon": 139.7})
+    assert c.get("/resolve_location", {"query": "Tokyo"}) == {"lat": 35.7, "lon": 139.7}
+    c.put("/execute_plan", {"plan": {}}, {"series": []})  # no TTL -> never stored
+    assert c.get("/execute_plan", {"plan": {}}) is None
+    assert (c.hits, c.misses) == (1, 0)
+
+
+def test_ttl_is_per_endpoint(tmp_path):
+    c = MCPCache(str(tmp_path / "m.sqlite"), ttls={"/plan_query": 60, "/resolve_location": 3600})
+    c.put("/plan_query", {"q": 1}, {"items": []})
+    c.put("/resolve_location", {"query": "Oslo"}, {"lat": 59.9})
+    with c._conn:
+        c._conn.execute("UPDATE mcp_cache SET ts = ts - 120")
+    assert c.get("/plan_query", {"q": 1}) is None
+    assert c.get("/resolve_location", {"query": "Oslo"}) == {"lat": 59.9}
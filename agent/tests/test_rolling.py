@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from meteo_chat.rolling import _rolling_mean_std_kernel, rolling_mean_std
+
+
+def _series():
+    rng = np.random.default_rng(0)
+    x = rng.normal(15.0, 4.0, size=400)
+    x[rng.choice(x.size, 60, replace=False)] = np.nan
+    x[100:130] = np.nan  # a gap longer than the window
+    return x
+
+
+@pytest.mark.parametrize("win,min_periods", [(24, 6), (5, 1), (10, 10)])
+@pytest.mark.parametrize("impl", [_rolling_mean_std_kernel, rolling_mean_std])
+def test_matches_pandas_rolling(impl, win, min_periods):
+    x = _series()
+    r = pd.Series(x).rolling(win, min_periods=min_periods)
+    mean, std = impl(x, win, min_periods)
+    np.testing.assert_allclose(mean, r.mean().to_numpy(), rtol=1e-9, atol=1e-9, equal_nan=True)
+    np.testing.assert_allclose(std, r.std().to_numpy(), rtol=1e-7, atol=1e-9, equal_nan=True)
@@ -0,0 +1,46 @@
+import numpy as np
+
+from meteo_chat.series import build_combined_df, series_arrays
+
+
+def _s(var, times, values):
+    return {"variable": var, "times": times, "values": values}
+
+
+def test_series_arrays_parses_once():
+    s = _s("t2m", ["2024-01-01T00:00", "2024-01-01T01:00"], [1.5, None])
+    t, v = series_arrays(s)
+    assert t.dtype == np.dtype("datetime64[ns]")
+    assert np.isnan(v[1]) and v[0] == 1.5
+    assert series_arrays(s)[1] is v
+
+
+def test_shared_axis_fast_path_drops_all_nan_rows():
+    ts = ["2024-01-01T00:00", "2024-01-01T01:00", "2024-01-01T02:00"]
+    df = build_combined_df([_s("a", ts, [1, None, 3]), _s("b", ts, [4, None, 6])])
+    assert list(df.columns) == ["time", "a", "b"]
+    assert df["a"].tolist() == [1, 3] and df["b"].tolist() == [4, 6]
+
+
+def test_union_of_timestamps():
+    df = build_combined_df([
+        _s("a", ["2024-01-01T00:00", "2024-01-01T01:00", "2024-01-01T02:00"], [1, 2, 3]),
+        _s("b", ["2024-01-01T03:00", "2024-01-01T01:00"], [30, 10]),
+    ])
+    assert df["time"].dt.hour.tolist() == [0, 1, 2, 3]
+    np.testing.assert_array_equal(df["a"].to_numpy(), [1, 2, 3, np.nan])
+    np.testing.assert_array_equal(df["b"].to_numpy(), [np.nan, 10, np.nan, 30])
+
+
+def test_union_duplicates_and_repeated_names_keep_the_first():
+    df = build_combined_df([
+        _s("a", ["2024-01-01T00:00", "2024-01-01T00:00", "2024-01-01T01:00"], [1, 5, 2]),
+        _s("a", ["2024-01-01T01:00", "2024-01-01T02:00"], [9, 7]),
+    ])
+    assert list(df.columns) == ["time", "a"]
+    assert df["a"].tolist() == [1, 2, 7]
+
+
+def test_empty_and_all_nan_series_are_skipped():
+    assert build_combined_df([]).empty
+    assert build_combined_df([_s("a", ["2024-01-01T00:00"], [None])]).empty
@@ -6,10 +6,19 @@ sparse-variable (rain/snow) handling for plots + summaries,
 local-LLM insight layer, form-only data fetch, dataset downloads, and sidebar chat.
 """
 
-import os, sys, re, base64, io, requests
+import os, sys, re, functools, hashlib, importlib.util, io, multiprocessing, threading, uuid, warnings, requests
+import requests.adapters
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
 from pathlib import Path
+from types import MappingProxyType
 import streamlit as st
-import matplotlib.pyplot as plt
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except ImportError:
+    add_script_run_ctx = get_script_run_ctx = None
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 import html
@@ -19,8 +28,15 @@ ROOT = Path(__file__).resolve().parents[2]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
+from meteo_chat import fastjson
+from meteo_chat.llm_cache import LLMCache, DEFAULT_CACHE_DIR
+from meteo_chat.mcp_cache import DEFAULT_PATH as MCP_CACHE_PATH, MCPCache
+from meteo_chat.plotting import is_sparse, render_job
+from meteo_chat.batching import build_batched_prompt, split_batched_reply
+from meteo_chat.series import build_combined_df, normalize_series as _normalize_series, series_arrays as _series_arrays
+
 st.set_page_config(page_title="Meteo-Chat", page_icon="🌤️", layout="centered")
-st.markdown("""
+_CSS_BLOCK = """
 <style>
 @import url('https://fonts.googleapis.com/css2?family=Quicksand:wght@300;500;700&display=swap');
 :root{ --bg1:#fff7f8; --bg2:#fff; --card:#ffffffcc; --stroke:#f2c6cf; --text:#2b2b2b;
@@ -43,6 +59,7 @@ html, body, [data-testid="stAppViewContainer"]{
 .card{ background:var(--card); border:1px solid var(--stroke);
        border-radius:18px; padding:16px 16px;
        box-shadow:0 6px 20px rgba(239,93,168,.08); }
+.card-stack > .card{ margin-bottom:1rem; }  /* cards batched into one element */
 .stButton>button{ background:linear-gradient(90deg,var(--accent),#ff80b5);
   color:white; border:none; padding:12px 22px; border-radius:14px;
   font-weight:700; letter-spacing:.2px;}
@@ -66,6 +83,15 @@ section[data-testid="stSidebar"] > div {
 }
 .msg-user { background:#fff4f8; }
 .msg-assistant { background:#fff; }
+.bubble { padding:10px 14px; border-radius:12px; margin:4px 0; font-size:0.95rem; }
+.bubble-user { background:#fff0f5; text-align:right; }
+.bubble-assistant { background:#ffe6f0; text-align:left; }
+/* sidebar chat icon buttons */
+div[data-testid="stHorizontalBlock"] button {
+  margin-top: -6px !important;
+  height: 2.2rem !important;
+  font-size: 1.3rem !important;
+}
 
 /* Download tab buttons */
 .download-wrap .stDownloadButton > button {
@@ -77,52 +103,71 @@ section[data-testid="stSidebar"] > div {
          border-top:1px dashed var(--stroke); text-align:center; }
 a, a:visited { color:#b91c57; text-decoration:none; }
 a:hover { text-decoration:underline; }
-</style>
-""", unsafe_allow_html=True)
 
-st.markdown(
-    """
-    <style>
-    /* Match Streamlit top bar with your app background */
-    header[data-testid="stHeader"] {
-        background: #fff0f5 !important;   /* pick your app’s main pastel tone */
-        color: #444 !important;
-    }
-    header [data-testid="stToolbar"] {
-        background: transparent !important;
-    }
-    </style>
-    """,
-    unsafe_allow_html=True,
-)
+/* Match Streamlit top bar with your app background */
+header[data-testid="stHeader"] {
+    background: #fff0f5 !important;   /* pick your app’s main pastel tone */
+    color: #444 !important;
+}
+header [data-testid="stToolbar"] {
+    background: transparent !important;
+}
+</style>
+"""
+st.markdown(_CSS_BLOCK, unsafe_allow_html=True)
 
 # ---------- Services ----------
 MCP = os.getenv("MCP_URL", "http://127.0.0.1:8787")
 LLM_URL = os.getenv("LLM_URL", "http://127.0.0.1:8899/generate")
-
-@st.cache_data(ttl=300)
-def mcp_post(ep, payload, timeout=90):
-    r = requests.post(f"{MCP}{ep}", json=payload, timeout=timeout)
-    r.raise_for_status()
-    return r.json()
+LLM_STREAM_URL = os.getenv("LLM_STREAM_URL", LLM_URL.rsplit("/", 1)[0] + "/generate_stream")
+
+@st.cache_resource(show_spinner=False)
+def _http_session() -> requests.Session:
+    """One keep-alive connection pool to MCP + LLM, shared across reruns and sessions."""
+    sess = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=0)
+    sess.mount("http://", adapter)
+    sess.mount("https://", adapter)
+    sess.headers.update({"Connection": "keep-alive"})
+    return sess
+
+@st.cache_resource(show_spinner=False)
+def _mcp_disk_cache():
+    return MCPCache(MCP_CACHE_PATH,
+                    verbose=os.getenv("METEO_CHAT_CACHE_VERBOSE", "0") == "1")
+
+# key order-insensitive: identical payloads built in a different order still hit
+@st.cache_data(ttl=300, show_spinner=False, hash_funcs={dict: lambda d: fastjson.dumps(d, sort_keys=True)})
+def mcp_post(path: str, payload: dict, timeout: int = 20):
+    """POST to the MCP server; JSON answers persist on disk per endpoint TTL (see meteo_chat.mcp_cache)."""
+    disk = _mcp_disk_cache()
+    cached = disk.get(path, payload)
+    if cached is not None:
+        return cached
+    r = _http_session().post(f"{MCP}{path}", data=fastjson.dumps(payload).encode("utf-8"),
+                             headers={"Content-Type": "application/json"}, timeout=timeout)
+    if not r.ok:
+        # Let callers handle r.json() if present
+        try:
+            msg = r.json().get("error", r.text)
+        except Exception:
+            msg = r.text
+        raise RuntimeError(f"MCP error ({r.status_code}): {msg}")
+    body = fastjson.loads(r.content)  # execute_plan bodies are large; skip requests' text decode
+    disk.put(path, payload, body)
+    return body
 
 # ---------- Session ----------
 if "last_result" not in st.session_state:
     # (place_name, loc, plan, ex, time_mode, variables, user_q)
     st.session_state["last_result"] = None
+if "plot_singlecore" not in st.session_state:
+    # render plots in-process (debugging / profiling): METEO_CHAT_SINGLECORE=1
+    st.session_state["plot_singlecore"] = os.getenv("METEO_CHAT_SINGLECORE", "0") == "1"
 if "chat" not in st.session_state:
     st.session_state["chat"] = []  # list of dicts: {"role":"user"/"assistant","content":str}
 
 # ---------- Helpers ----------
-def _fig_to_b64():
-    buf = io.BytesIO()
-    plt.tight_layout()
-    plt.savefig(buf, format="png", dpi=150, bbox_inches="tight")
-    buf.seek(0)
-    out = base64.b64encode(buf.read()).decode("ascii")
-    plt.close()
-    return out
-
 def openmeteo_doc_links(mode):
     base = "https://open-meteo.com/en/docs"
     hist = "https://open-meteo.com/en/docs/historical-weather-api"
@@ -145,12 +190,6 @@ def _format_duration(td: timedelta) -> str:
     if len(parts) == 2: return f"{parts[0]} and {parts[1]}"
     return f"{', '.join(parts[:-1])} and {parts[-1]}"
 
-def is_sparse_series(s: pd.Series, thresh=0.05) -> bool:
-    s = pd.to_numeric(s, errors="coerce").fillna(0)
-    if len(s) == 0:
-        return False
-    return (s > 0).mean() <= thresh
-
 def window_line(plan, ex):
     win = ex.get("window") or (plan.get("meta",{}) or {}).get("historical_window")
     if not win: return None
@@ -162,56 +201,55 @@ def window_line(plan, ex):
         yrs_txt = "—"
     return f"Data window: {win['start']} → {win['end']} (≈{yrs_txt})"
 
+# ---------- Series ingestion ----------
+def _has_data(s: dict) -> bool:
+    """False for empty / all-NaN series (e.g. unsupported at this location): one C scan, no DataFrame."""
+    v = _series_arrays(s)[1]
+    return v.size > 0 and bool(np.isfinite(v).any())
+
 # ---------- Plotters ----------
-def plot_time_series(title, unit, times, values, show_roll=False, win=24):
-    t = pd.to_datetime(times) if times else pd.to_datetime([])
-    s = pd.to_numeric(pd.Series(values), errors="coerce") if values else pd.Series([])
-    sparse = is_sparse_series(s)
-    if sparse:
-        mask = s > 0
-        t = t[mask]; s = s[mask]
-    plt.figure(figsize=(9.5, 3.6))
-    if show_roll and len(s) > win:
-        rm = s.rolling(win, min_periods=max(3, win//4)).mean()
-        rs = s.rolling(win, min_periods=max(3, win//4)).std()
-        plt.fill_between(t, rm - rs, rm + rs, alpha=0.18, label="±1σ")
-        plt.plot(t, rm, linewidth=1.8, label="Rolling mean")
-        plt.plot(t, s, alpha=0.35, linewidth=0.9, label="Raw")
-        plt.legend()
-    else:
-        plt.plot(t, s)
-    plt.title(title + (" (non-zero events)" if sparse else ""))
-    plt.xlabel("Time"); plt.ylabel(unit or ""); plt.xticks(rotation=15)
-    return _fig_to_b64()
-
-def plot_box(title, unit, times, values, group="hour"):
-    df = pd.DataFrame({"t": pd.to_datetime(times),
-                       "v": pd.to_numeric(values, errors="coerce")}).dropna()
-    if df.empty:
-        plt.figure(figsize=(9.5, 3.6)); plt.title(title + " (no data)")
-        return _fig_to_b64()
-    sparse = is_sparse_series(df["v"])
-    if sparse:
-        df = df[df["v"] > 0]
-    if df.empty:
-        plt.figure(figsize=(9.5, 3.6)); plt.title(title + " (no non-zero events)")
-        return _fig_to_b64()
-    df["g"] = df["t"].dt.hour if group == "hour" else df["t"].dt.month
-    order = sorted(df["g"].unique())
-    groups = [df.loc[df.g==g, "v"].values for g in order]
-    labels = [f"{g:02d}" if group=="hour" else
-              ["Jan","Feb","Mar","Apr","May","Jun","Jul","Aug","Sep","Oct","Nov","Dec"][g-1]
-              for g in order]
-    fig, ax = plt.subplots(figsize=(9.5, 3.6))
-    bp = ax.boxplot(groups, labels=labels, patch_artist=True, showfliers=False,
-                    medianprops=dict(color="#9c1749"))
-    for p in bp["boxes"]:
-        p.set_facecolor("#f6a3c5"); p.set_alpha(0.35); p.set_edgecolor("#b91c57")
-    ax.set_ylabel(unit or "")
-    ax.set_title(title + (" (non-zero events)" if sparse else "") +
-                 (" (diurnal)" if group=="hour" else " (monthly)"))
-    ax.set_xlabel("Hour (UTC)" if group=="hour" else "Month")
-    return _fig_to_b64()
+def _series_fingerprint(times: np.ndarray, values: np.ndarray) -> str:
+    """Cheap content hash so cached plots can skip hashing the raw arrays."""
+    h = hashlib.blake2b(digest_size=8)
+    h.update(np.ascontiguousarray(times).view("i8").tobytes())
+    h.update(np.ascontiguousarray(values).tobytes())
+    return h.hexdigest()
+
+@st.cache_resource(show_spinner=False)
+def _plot_pool():
+    # spawn, not fork: forking Streamlit's multithreaded server can copy locks other threads
+    # hold (matplotlib font cache, logging, the sqlite caches) and deadlock the worker
+    return ProcessPoolExecutor(max_workers=min(4, os.cpu_count() or 1),
+                               mp_context=multiprocessing.get_context("spawn"))
+
+# "process" (default) or "thread": threads skip pickling the arrays but share the GIL
+PLOT_BACKEND = os.getenv("METEO_CHAT_PLOT_BACKEND", "process")
+
+def _render_in_threads(jobs):
+    # safe: plotting renders into one pyplot-free Figure per thread
+    with ThreadPoolExecutor(max_workers=min(len(jobs), 8)) as pool:
+        return list(pool.map(render_job, jobs))
+
+@st.cache_data(show_spinner=False, ttl=600)
+def render_figures(job_keys, _jobs, singlecore=False):
+    """
+    Encoded image bytes (see plotting.FIG_FORMAT) per plot job, in job order. Jobs fan out to worker processes
+    (or threads, see PLOT_BACKEND); `job_keys` carries the data fingerprints
+    so reruns with unchanged data hit the cache.
+    """
+    if singlecore or len(_jobs) < 2:
+        return [render_job(j) for j in _jobs]
+    if PLOT_BACKEND == "thread":
+        return _render_in_threads(_jobs)
+    out = [None] * len(_jobs)
+    try:
+        futs = {_plot_pool().submit(render_job, j): i for i, j in enumerate(_jobs)}
+        for f in as_completed(futs):
+            out[futs[f]] = f.result()
+    except BrokenProcessPool:
+        _plot_pool.clear()  # drop the dead pool; next call builds a fresh one
+        return _render_in_threads(_jobs)
+    return out
 
 # ---------- LLM Bridge (concise + cleaned) ----------
 def synthesize_form_question(place_name: str, mode_sel: str, variables: list, fc_days: int, hist_years: int) -> str:
@@ -223,40 +261,69 @@ def synthesize_form_question(place_name: str, mode_sel: str, variables: list, fc
     else:
         return f"Current {pretty_vars} conditions in {place_name}."
 
-def _compact_stats_line(var: str, unit: str, values: pd.Series) -> str:
-    v = pd.to_numeric(values, errors="coerce").dropna()
-    if v.empty:
-        return ""
-    mean, std = v.mean(), v.std()
-    vmin, vmax = v.min(), v.max()
-    line = f"- {var}: mean={mean:.2f}{unit}, std={std:.2f}{unit}, range={vmin:.2f}–{vmax:.2f}{unit}"
-    # sparse hint
-    nz_frac = (v > 0).mean() if len(v) else 0.0
-    if nz_frac > 0 and nz_frac <= 0.20:
-        line += f", nonzero%={100*nz_frac:.1f}"
-    return line
+def _values_matrix(series) -> np.ndarray:
+    """Stack each series' values into one (n_vars, max_len) float array, NaN-padded."""
+    rows = [_series_arrays(s)[1] for s in series]
+    arr = np.full((len(rows), max((len(r) for r in rows), default=0)), np.nan)
+    for i, r in enumerate(rows):
+        arr[i, :len(r)] = r
+    return arr
+
+def _compact_stats_lines(series) -> list[str]:
+    """One stats line per variable; all reductions run column-wise over a single array."""
+    arr = _values_matrix(series)
+    if arr.size == 0:
+        return []
+    finite = ~np.isnan(arr)
+    counts = finite.sum(axis=1)
+    with warnings.catch_warnings():
+        # all-NaN rows / single-sample std -> NaN; those rows are skipped below
+        warnings.simplefilter("ignore", RuntimeWarning)
+        means = np.nanmean(arr, axis=1)
+        stds = np.nanstd(arr, axis=1, ddof=1)
+        mins, maxs = np.nanmin(arr, axis=1), np.nanmax(arr, axis=1)
+    nz_fracs = (arr > 0).sum(axis=1) / np.maximum(counts, 1)
+    lines = []
+    for s, n, mean, std, vmin, vmax, nz_frac in zip(series, counts, means, stds, mins, maxs, nz_fracs):
+        if n == 0:
+            continue
+        var, unit = s.get("variable", ""), s.get("unit", "") or ""
+        line = f"- {var}: mean={mean:.2f}{unit}, std={std:.2f}{unit}, range={vmin:.2f}–{vmax:.2f}{unit}"
+        # sparse hint
+        if nz_frac > 0 and nz_frac <= 0.20:
+            line += f", nonzero%={100*nz_frac:.1f}"
+        lines.append(line)
+    return lines
 
 # --- LLM output cleaner ---
 _SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+_RE_ANSWER_MARKER = re.compile(r"(?i)\b(answer|assistant):")
+_RE_ANSWER_ONLY = re.compile(r'(?i)(assistant\s*\(answer only\)\s*:|answer only\s*:)')
+# commentary / disclaimers / hashtags, all dropped in one substitution pass
+_RE_NOISE = re.compile(
+    r"(?i)user asked.*"
+    r"|assistant(?:'?s)? response.*"
+    r"|\b(?:note|disclaimer|source|context)\b.*"
+    r"|(?:please note|knowledge cutoff).*"
+    r"|#[\w\-]+"
+)
 
 def clean_llm(raw: str) -> str:
-    """Return only the assistant's concise reply after the last 'answer only' marker."""
+    """Return only the assistant's concise reply, without echoed markers, commentary or hashtags."""
     if not raw:
         return ""
     txt = raw.strip()
 
-    # Keep only after the final answer marker
-    match = re.split(r'(?i)(assistant\s*\(answer only\)\s*:|answer only\s*:)', txt)
+    # Skip anything before the first plausible answer
+    cleaned = _RE_ANSWER_MARKER.split(txt, maxsplit=1)
+    if len(cleaned) > 2:
+        txt = cleaned[2]
+    # Keep only after the final 'answer only' marker
+    match = _RE_ANSWER_ONLY.split(txt)
     if len(match) > 1:
         txt = match[-1]
 
-    # Drop internal commentary
-    txt = re.sub(r"(?i)user asked.*", "", txt)
-    txt = re.sub(r"(?i)assistant('?s)? response.*", "", txt)
-    txt = re.sub(r"(?i)\b(note|disclaimer|source|context)\b.*", "", txt)
-    txt = re.sub(r"(?:\s*#[\w\-]+)+\s*$", "", txt)
-    txt = txt.strip()
-    return txt
+    return _RE_NOISE.sub("", txt).strip()
 
 def build_llm_context(place_name, plan, ex):
     lines = [f"Place: {place_name}"]
@@ -268,35 +335,18 @@ def build_llm_context(place_name, plan, ex):
     vnames = [s.get("variable","") for s in series if s.get("variable")]
     if vnames:
         lines.append("Variables: " + ", ".join(vnames))
-    for s in series:
-        var = s.get("variable","")
-        unit = s.get("unit","") or ""
-        vals = pd.to_numeric(pd.Series(s.get("values", [])), errors="coerce")
-        ln = _compact_stats_line(var, unit, vals)
-        if ln: lines.append(ln)
+    lines.extend(_compact_stats_lines(series))
     # a couple of recent samples for grounding
     for s in series[:3]:
         var = s.get("variable","")
         unit = s.get("unit","") or ""
-        t = pd.to_datetime(s.get("times", []))
-        v = pd.to_numeric(pd.Series(s.get("values", [])), errors="coerce")
-        df = pd.DataFrame({"t": t, "v": v}).dropna()
-        if len(df) >= 3:
-            tail = df.tail(3)
+        t, v = _series_arrays(s)
+        idx = np.flatnonzero(~(np.isnan(v) | np.isnat(t)))[-3:]
+        if idx.size >= 3:
             lines.append(f"- recent {var} samples: " +
-                         ", ".join(f"{row.v:.2f}{unit}@{row.t:%m-%d %H:%M}" for _, row in tail.iterrows()))
+                         ", ".join(f"{v[i]:.2f}{unit}@{pd.Timestamp(t[i]):%m-%d %H:%M}" for i in idx))
     return "\n".join(lines)
 
-def _clean_llm(text: str) -> str:
-    if not text: return ""
-    # Strip any echoed instructions / headers
-    text = re.sub(r"(?is)^\\s*(you are|dataset context|context:|instructions?|assistant:|system:).*?\\n", "", text).strip()
-    # Remove trailing meta blocks
-    text = re.sub(r"(?is)\\n(?:source|limitations|note|summary structure|additional information).*", "", text).strip()
-    # Collapse whitespace
-    text = re.sub(r"\\n{3,}", "\\n\\n", text).strip()
-    return text
-
 def build_llm_prompt_for_summary(context: str, user_question: str):
     return (
         "You are Meteo-Chat. Use ONLY the dataset below. "
@@ -308,12 +358,12 @@ def build_llm_prompt_for_summary(context: str, user_question: str):
         "Answer only:"
     )
 
+def _history_text(turns: list) -> str:
+    # Collect turns of dialogue, formatted cleanly
+    return "\n".join(f"{m['role'].upper()}: {m['content'].strip()}" for m in turns)
+
 def build_llm_prompt_for_chat(context: str, chat_history: list, user_msg: str):
-    # Collect the last few turns of dialogue, formatted cleanly
-    history_text = "\n".join(
-        f"{m['role'].upper()}: {m['content'].strip()}"
-        for m in chat_history[-4:]
-    )
+    history_text = _history_text(chat_history[-4:])
 
     return (
         "You are Meteo-Chat, a conversational weather assistant that knows only the dataset shown below. "
@@ -326,43 +376,266 @@ def build_llm_prompt_for_chat(context: str, chat_history: list, user_msg: str):
         "ASSISTANT (answer only):"
     )
 
-def query_llm(prompt: str):
-    """Query the LLM and clean out any echoed prompt, instructions, or hashtags."""
-    try:
-        r = requests.post(LLM_URL, json={"prompt": prompt}, timeout=45)
+class LLMStreamError(RuntimeError):
+    """The SSE stream reported a generation failure or ended without [DONE]."""
+
+def stream_llm(prompt: str):
+    """Yield completion tokens from the LLM's SSE endpoint as they arrive."""
+    with _http_session().post(LLM_STREAM_URL, json={"prompt": prompt}, stream=True, timeout=45) as r:
         r.raise_for_status()
-        txt = r.json().get("text") or r.json().get("generated_text") or ""
-        # remove everything before first plausible answer
-        cleaned = re.split(r"(?i)\b(answer|assistant):", txt, maxsplit=1)
-        if len(cleaned) > 2:
-            txt = cleaned[2]
-        # strip hashtags, disclaimers, trailing noise
-        txt = re.sub(r"#\w+", "", txt)
-        txt = re.sub(r"(?i)(please note|disclaimer|knowledge cutoff).*", "", txt)
-        return txt.strip()
+        r.encoding = "utf-8"
+        event = None
+        for line in r.iter_lines(decode_unicode=True):
+            if not line:
+                event = None
+                continue
+            if line.startswith("event:"):
+                event = line[6:].strip()
+                continue
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if event == "error":
+                raise LLMStreamError(fastjson.loads(data).get("error") or "generation failed")
+            if data == "[DONE]":
+                return
+            yield fastjson.loads(data).get("token", "")
+        raise LLMStreamError("stream ended without [DONE]")
+
+@st.cache_resource(show_spinner=False)
+def _llm_cache():
+    return LLMCache(os.path.join(DEFAULT_CACHE_DIR, "llm_cache.sqlite"))
+
+@st.cache_resource(show_spinner=False)
+def _question_embedder():
+    """Small local sentence encoder (optional: sentence-transformers). None -> exact-match cache only."""
+    try:
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2"))
+    except Exception:
+        return None
+
+def _embed_question(question: str):
+    model = _question_embedder()
+    if model is None:
+        return None
+    return model.encode([question], normalize_embeddings=True)[0].astype(np.float32)
+
+def query_llm(prompt: str, container=None, context: str = None, question: str = None):
+    """
+    Query the LLM and clean out any echoed prompt, instructions, or hashtags.
+    With a `container` (e.g. st.empty()), tokens are painted into it as they
+    stream in; cleaning still runs once on the full text at the end.
+    With `context` + `question`, a semantically matching earlier reply for the
+    same context key is returned without calling the LLM (chat calls fold the
+    recent turns into `context`; numbers and max/min-style words must match).
+    """
+    if not (context and question):
+        return _query_llm_memo(prompt, container)
+    q_vec = _embed_question(question)
+    hit = _llm_cache().get(context, question, q_vec)
+    if hit is not None:
+        if container is not None:
+            container.markdown(hit)
+        return hit
+    reply = _query_llm_memo(prompt, container)
+    if reply and not reply.startswith("[LLM error"):
+        _llm_cache().put(context, question, reply, q_vec)
+    return reply
+
+def query_llm_batch(context: str, questions: list[str], container=None) -> list:
+    """
+    Answers for several questions about one dataset context. Cached answers
+    are reused; the rest go out as ONE batched prompt and are cached
+    individually once parsed. Entries are None where no answer came back.
+    """
+    cache = _llm_cache()
+    vecs = [_embed_question(q) for q in questions]
+    answers = [cache.get(context, q, v) for q, v in zip(questions, vecs)]
+    todo = [i for i, a in enumerate(answers) if a is None]
+    if len(todo) == 1:
+        i = todo[0]
+        reply = query_llm(build_llm_prompt_for_summary(context, questions[i]), container,
+                          context=context, question=questions[i])
+        answers[i] = reply if reply and not reply.startswith("[LLM error") else None
+    elif todo:
+        reply = _query_llm_memo(build_batched_prompt(context, [questions[i] for i in todo]), container)
+        if not reply.startswith("[LLM error"):
+            parts = split_batched_reply(reply, len(todo))
+            for i, part in zip(todo, parts):
+                if part:
+                    answers[i] = part
+                    cache.put(context, questions[i], part, vecs[i])
+            if not any(parts) and reply.strip():
+                answers[todo[0]] = reply.strip()  # model ignored the labels: show it, but don't cache it
+    return answers
+
+PROMPT_MEMO_SIZE = 256
+
+@st.cache_resource(show_spinner=False)
+def _prompt_memo():
+    """In-process LRU of replies keyed on the exact prompt's hash, shared across sessions."""
+    return OrderedDict(), threading.Lock()
+
+def _query_llm_memo(prompt: str, container=None):
+    """
+    Identical prompts (re-asked question, same history) skip the LLM entirely,
+    ahead of the on-disk semantic cache (context key + question).
+    Errors are never memoized.
+    """
+    memo, lock = _prompt_memo()
+    key = hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).digest()
+    with lock:
+        hit = memo.get(key)
+        if hit is not None:
+            memo.move_to_end(key)
+    if hit is not None:
+        if container is not None:
+            container.markdown(hit)
+        return hit
+    reply = _query_llm_uncached(prompt, container)
+    if reply and not reply.startswith("[LLM error"):
+        with lock:
+            memo[key] = reply
+            while len(memo) > PROMPT_MEMO_SIZE:
+                memo.popitem(last=False)
+    return reply
+
+def _query_llm_uncached(prompt: str, container=None):
+    try:
+        txt = None
+        if container is not None:
+            try:
+                txt = container.write_stream(stream_llm(prompt))
+            except (requests.RequestException, LLMStreamError):
+                txt = None  # no streaming endpoint or stream failed: fall back to one blocking call
+        if txt is None:
+            r = _http_session().post(LLM_URL, json={"prompt": prompt}, timeout=45)
+            r.raise_for_status()
+            txt = r.json().get("text") or r.json().get("generated_text") or ""
+        reply = clean_llm(txt)
+        if container is not None:
+            container.markdown(reply)  # replace the raw (or partial) streamed text
+        return reply
     except Exception as e:
         return f"[LLM error: {e}]"
 
 # ---------- Data shaping for downloads ----------
-def build_combined_df(series_list):
-    frames = []
+def _arrow_csv_bytes(table) -> bytes:
+    """Arrow's C++ CSV writer straight into bytes."""
+    import pyarrow as pa, pyarrow.csv as pacsv
+    # second resolution + minimal quoting so the file reads like pandas' to_csv output
+    for i, field in enumerate(table.schema):
+        if pa.types.is_timestamp(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.timestamp("s", tz=field.type.tz), safe=False))
+    buf = io.BytesIO()
+    pacsv.write_csv(table, buf, write_options=pacsv.WriteOptions(quoting_style="needed"))
+    return buf.getvalue()
+
+def df_to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """CSV via Arrow; pandas fallback if pyarrow is missing/old."""
+    try:
+        import pyarrow as pa
+        return _arrow_csv_bytes(pa.Table.from_pandas(df, preserve_index=False))
+    except (ImportError, TypeError, AttributeError):
+        return df.to_csv(index=False).encode("utf-8")
+
+def _columnar_bytes(table, fmt: str) -> bytes:
+    """Parquet or Feather v2 (Arrow IPC), zstd-compressed."""
+    import pyarrow.feather as feather, pyarrow.parquet as pq
+    buf = io.BytesIO()
+    if fmt == "parquet":
+        pq.write_table(table, buf, compression="zstd", row_group_size=64 * 1024)
+    else:
+        feather.write_feather(table, buf, compression="zstd")
+    return buf.getvalue()
+
+def df_to_bytes(df: pd.DataFrame, fmt: str = "csv") -> bytes:
+    if fmt == "csv":
+        return df_to_csv_bytes(df)
+    import pyarrow as pa
+    return _columnar_bytes(pa.Table.from_pandas(df, preserve_index=False), fmt)
+
+def series_to_bytes(var: str, times: np.ndarray, values: np.ndarray, fmt: str = "csv") -> bytes:
+    """time,<var> file for one series, built as a typed Arrow table directly from the arrays (no DataFrame)."""
+    ok = ~np.isnat(times) & ~np.isnan(values)
+    if not ok.any():
+        return b""
+    if fmt != "csv":
+        import pyarrow as pa
+        return _columnar_bytes(pa.table({"time": pa.array(times[ok]), var: pa.array(values[ok])}), fmt)
+    try:
+        import pyarrow as pa
+        return _arrow_csv_bytes(pa.table({"time": pa.array(times[ok]), var: pa.array(values[ok])}))
+    except (ImportError, TypeError, AttributeError):
+        return pd.DataFrame({"time": times[ok], var: values[ok]}).to_csv(index=False).encode("utf-8")
+
+# (fmt, button label, extension, mime); columnar formats only when pyarrow is importable
+DOWNLOAD_FORMATS = [("csv", "CSV", "csv", "text/csv")]
+if importlib.util.find_spec("pyarrow") is not None:
+    DOWNLOAD_FORMATS += [("parquet", "Parquet", "parquet", "application/vnd.apache.parquet"),
+                         ("arrow", "Arrow", "arrow", "application/vnd.apache.arrow.file")]
+
+# encoded once per dataset: reruns (chat sends, slider moves) reuse the bytes.
+# Keyed on the data fingerprint; the `_`-prefixed payload args are not hashed.
+@st.cache_data(show_spinner=False)
+def _series_download(var: str, fingerprint: str, fmt: str, _times, _values) -> bytes:
+    return series_to_bytes(var, _times, _values, fmt)
+
+def _combined_bytes_polars(series_list, fmt: str):
+    """
+    Combined export via Polars: one LazyFrame per series, outer-joined on time,
+    written by Polars' native CSV/Parquet/IPC writers. None -> use the NumPy path.
+    """
+    import polars as pl
+    frames, names = [], []
     for s in series_list:
-        t = pd.to_datetime(s.get("times", []))
-        v = pd.to_numeric(pd.Series(s.get("values", [])), errors="coerce")
-        if len(t) == 0 or v.dropna().empty:
+        t, v = _series_arrays(s)
+        if len(t) == 0 or np.isnan(v).all():
             continue
-        df = pd.DataFrame({"time": t, s.get("variable","var"): v})
-        frames.append(df.dropna())
+        name = s.get("variable","var")
+        if name in names:
+            return None  # repeated variable name: build_combined_df merges those (earlier series wins)
+        names.append(name)
+        frames.append(
+            pl.LazyFrame({"time": t, name: v})
+            .filter(pl.col("time").is_not_null() & pl.col(name).is_not_nan())
+            .unique(subset="time", keep="first", maintain_order=True)  # duplicate stamps: first sample
+        )
     if not frames:
-        return pd.DataFrame()
-    out = frames[0]
-    for df in frames[1:]:
-        out = out.merge(df, on="time", how="outer")
-    out = out.sort_values("time").reset_index(drop=True)
-    return out
+        return b""
+    combined = functools.reduce(lambda a, b: a.join(b, on="time", how="full", coalesce=True), frames)
+    df = combined.sort("time").collect()
+    buf = io.BytesIO()
+    if fmt == "csv":
+        df.write_csv(buf, datetime_format="%Y-%m-%d %H:%M:%S")  # same shape as the Arrow/pandas CSVs
+    elif fmt == "parquet":
+        df.write_parquet(buf, compression="zstd", row_group_size=64 * 1024)
+    else:
+        df.write_ipc(buf, compression="zstd")
+    return buf.getvalue()
 
-def df_to_csv_bytes(df: pd.DataFrame) -> bytes:
-    return df.to_csv(index=False).encode("utf-8")
+_HAS_POLARS = importlib.util.find_spec("polars") is not None
+
+@st.cache_data(show_spinner=False)
+def _combined_download(fingerprints: tuple, fmt: str, _series) -> bytes:
+    if _HAS_POLARS:
+        try:
+            out = _combined_bytes_polars(_series, fmt)
+            if out is not None:
+                return out
+        except Exception:
+            pass  # e.g. polars too old for how="full" (ValueError / InvalidOperationError): fall through to pandas/Arrow
+    combined = build_combined_df(_series)
+    return df_to_bytes(combined, fmt) if not combined.empty else b""
+
+_FORMAT_INFO = {f[0]: f for f in DOWNLOAD_FORMATS}
+
+def _download_button(label: str, stem: str, key: str, fmt: str, make):
+    """Button for the selected format only; `make(fmt)` encodes just that one (cached per dataset)."""
+    _, name, ext, mime = _FORMAT_INFO[fmt]
+    st.download_button(f"{label} {name}", data=make(fmt), file_name=f"{stem}.{ext}",
+                       mime=mime, key=key if fmt == "csv" else f"{key}_{fmt}")
 
 # ---------- HERO ----------
 st.markdown("""
@@ -405,6 +678,82 @@ go_form = st.button("Submit", key="form_submit")
 
 # ---------- Variable aliasing + capability filtering ----------
 
+# canonical map (lowercased keys); read-only so it can't drift between reruns
+_VARIABLE_ALIASES = MappingProxyType({
+    # Temperature
+    "temp": "temperature_2m",
+    "temperature": "temperature_2m",
+    "air_temperature": "temperature_2m",
+    "t2m": "temperature_2m",
+    "apparent_temperature": "apparent_temperature",
+    "feels_like": "apparent_temperature",
+    # Dew point / humidity
+    "dewpoint": "dew_point_2m",
+    "dew_point": "dew_point_2m",
+    "dew_point_temperature": "dew_point_2m",
+    "humidity": "relative_humidity_2m",
+    "relative_humidity": "relative_humidity_2m",
+    "rh": "relative_humidity_2m",
+    # Wind
+    "wind": "wind_speed_10m",
+    "winds": "wind_speed_10m",
+    "wind_speed": "wind_speed_10m",
+    "wind_speed_10m": "wind_speed_10m",
+    "wind_dir": "wind_direction_10m",
+    "wind_direction": "wind_direction_10m",
+    "wind_gusts": "wind_gusts_10m",
+    "wind_gust": "wind_gusts_10m",
+    # Precipitation
+    "precip": "precipitation",
+    "precipitation": "precipitation",
+    "rain": "rain",
+    "snow": "snowfall",
+    "snowfall": "snowfall",
+    "snow_depth": "snow_depth",
+    # Cloud / radiation
+    "cloud": "cloud_cover",
+    "clouds": "cloud_cover",
+    "cloud_cover": "cloud_cover",
+    "shortwave_radiation": "shortwave_radiation",
+    "direct_radiation": "direct_radiation",
+    "diffuse_radiation": "diffuse_radiation",
+    "et0": "et0_fao_evapotranspiration",
+    "evapotranspiration": "et0_fao_evapotranspiration",
+    # Pressure
+    "mslp": "pressure_msl",
+    "sea_level_pressure": "pressure_msl",
+    "surface_pressure": "surface_pressure",
+    # Soil (multi-depth)
+    "soil_surface_temperature": "soil_temperature_0cm",
+    "soil_temperature_surface": "soil_temperature_0cm",
+    "soil_temp_surface": "soil_temperature_0cm",
+    "soil_temperature_0cm": "soil_temperature_0cm",
+    "soil_temp_0cm": "soil_temperature_0cm",
+    "soil_temperature_6cm": "soil_temperature_6cm",
+    "soil_temp_6cm": "soil_temperature_6cm",
+    "soil_temperature_18cm": "soil_temperature_18cm",
+    "soil_temp_18cm": "soil_temperature_18cm",
+    "soil_temperature_54cm": "soil_temperature_54cm",
+    "soil_temp_54cm": "soil_temperature_54cm",
+    "soil_moisture_0_1cm": "soil_moisture_0_to_1cm",
+    "soil_moisture_0_1": "soil_moisture_0_to_1cm",
+    "soil_moisture_1_3cm": "soil_moisture_1_to_3cm",
+    "soil_moisture_3_9cm": "soil_moisture_3_to_9cm",
+    "soil_moisture_9_27cm": "soil_moisture_9_to_27cm",
+    "soil_moisture_27_81cm": "soil_moisture_27_to_81cm",
+    # Solar geometry
+    "sunrise": "sunrise",
+    "sunset": "sunset",
+    # Daily aggregates (if your MCP supports daily mode)
+    "tmax": "temperature_2m_max",
+    "tmin": "temperature_2m_min",
+    "temperature_max": "temperature_2m_max",
+    "temperature_min": "temperature_2m_min",
+    # Others (add more as needed)
+    "visibility": "visibility",
+    "uv_index": "uv_index",
+})
+
 def resolve_variable_aliases(query_vars: list[str], mode: str) -> list[str]:
     """
     Map free-form user variable names to Open-Meteo canonical keys.
@@ -413,87 +762,11 @@ def resolve_variable_aliases(query_vars: list[str], mode: str) -> list[str]:
     if not query_vars:
         return []
 
-    # canonical map (lowercased keys)
-    alias = {
-        # Temperature
-        "temp": "temperature_2m",
-        "temperature": "temperature_2m",
-        "air_temperature": "temperature_2m",
-        "t2m": "temperature_2m",
-        "apparent_temperature": "apparent_temperature",
-        "feels_like": "apparent_temperature",
-        # Dew point / humidity
-        "dewpoint": "dew_point_2m",
-        "dew_point": "dew_point_2m",
-        "dew_point_temperature": "dew_point_2m",
-        "humidity": "relative_humidity_2m",
-        "relative_humidity": "relative_humidity_2m",
-        "rh": "relative_humidity_2m",
-        # Wind
-        "wind": "wind_speed_10m",
-        "winds": "wind_speed_10m",
-        "wind_speed": "wind_speed_10m",
-        "wind_speed_10m": "wind_speed_10m",
-        "wind_dir": "wind_direction_10m",
-        "wind_direction": "wind_direction_10m",
-        "wind_gusts": "wind_gusts_10m",
-        "wind_gust": "wind_gusts_10m",
-        # Precipitation
-        "precip": "precipitation",
-        "precipitation": "precipitation",
-        "rain": "rain",
-        "snow": "snowfall",
-        "snowfall": "snowfall",
-        "snow_depth": "snow_depth",
-        # Cloud / radiation
-        "cloud": "cloud_cover",
-        "clouds": "cloud_cover",
-        "cloud_cover": "cloud_cover",
-        "shortwave_radiation": "shortwave_radiation",
-        "direct_radiation": "direct_radiation",
-        "diffuse_radiation": "diffuse_radiation",
-        "et0": "et0_fao_evapotranspiration",
-        "evapotranspiration": "et0_fao_evapotranspiration",
-        # Pressure
-        "mslp": "pressure_msl",
-        "sea_level_pressure": "pressure_msl",
-        "surface_pressure": "surface_pressure",
-        # Soil (multi-depth)
-        "soil_surface_temperature": "soil_temperature_0cm",
-        "soil_temperature_surface": "soil_temperature_0cm",
-        "soil_temp_surface": "soil_temperature_0cm",
-        "soil_temperature_0cm": "soil_temperature_0cm",
-        "soil_temp_0cm": "soil_temperature_0cm",
-        "soil_temperature_6cm": "soil_temperature_6cm",
-        "soil_temp_6cm": "soil_temperature_6cm",
-        "soil_temperature_18cm": "soil_temperature_18cm",
-        "soil_temp_18cm": "soil_temperature_18cm",
-        "soil_temperature_54cm": "soil_temperature_54cm",
-        "soil_temp_54cm": "soil_temperature_54cm",
-        "soil_moisture_0_1cm": "soil_moisture_0_to_1cm",
-        "soil_moisture_0_1": "soil_moisture_0_to_1cm",
-        "soil_moisture_1_3cm": "soil_moisture_1_to_3cm",
-        "soil_moisture_3_9cm": "soil_moisture_3_to_9cm",
-        "soil_moisture_9_27cm": "soil_moisture_9_to_27cm",
-        "soil_moisture_27_81cm": "soil_moisture_27_to_81cm",
-        # Solar geometry
-        "sunrise": "sunrise",
-        "sunset": "sunset",
-        # Daily aggregates (if your MCP supports daily mode)
-        "tmax": "temperature_2m_max",
-        "tmin": "temperature_2m_min",
-        "temperature_max": "temperature_2m_max",
-        "temperature_min": "temperature_2m_min",
-        # Others (add more as needed)
-        "visibility": "visibility",
-        "uv_index": "uv_index",
-    }
-
     out = []
     seen = set()
     for v in query_vars:
         k = v.strip().lower()
-        cand = alias.get(k, k)   # fall back to user key if unknown
+        cand = _VARIABLE_ALIASES.get(k, k)   # fall back to user key if unknown
         if cand not in seen:
             seen.add(cand)
             out.append(cand)
@@ -561,18 +834,6 @@ def _caps_supported_set(caps: dict, mode: str) -> set[str]:
     # normalize to lowercase
     return {v.lower() for v in supp}
 
-def mcp_post(path: str, payload: dict):
-    url = f"http://127.0.0.1:8787{path}"
-    r = requests.post(url, json=payload, timeout=20)
-    if not r.ok:
-        # Let callers handle r.json() if present
-        try:
-            msg = r.json().get("error", r.text)
-        except Exception:
-            msg = r.text
-        raise RuntimeError(f"MCP error ({r.status_code}): {msg}")
-    return r.json()
-
 def filter_supported_variables(caps: dict, variables: list[str], mode: str) -> tuple[list[str], list[str]]:
     """
     Keep only variables supported by the capability set for the selected mode.
@@ -592,13 +853,21 @@ def filter_supported_variables(caps: dict, variables: list[str], mode: str) -> t
     # Avoid empty requests: if everything got dropped, keep originals so user sees MCP error
     return (kept or variables), dropped
 
-def run_query(use_place, mode_sel, vars_sel, opt):
-    caps = mcp_post("/describe_capabilities", {})
-    try:
-        loc = mcp_post("/resolve_location", {"query": use_place})
-    except RuntimeError as e:
-        st.error(str(e))
-        st.stop()
+def fetch_caps_and_location(use_place):
+    """
+    /describe_capabilities and /resolve_location don't depend on each other:
+    fire both at once so the submit pays one round-trip instead of two.
+    The pool threads inherit this run's context, as in run_in_thread (mcp_post is st.cache_data).
+    """
+    ctx = get_script_run_ctx() if get_script_run_ctx is not None else None
+    attach = (lambda: add_script_run_ctx(threading.current_thread(), ctx)) if ctx is not None else None
+    with ThreadPoolExecutor(max_workers=2, initializer=attach) as pool:
+        caps_f = pool.submit(mcp_post, "/describe_capabilities", {})
+        loc_f = pool.submit(mcp_post, "/resolve_location", {"query": use_place})
+        return caps_f.result(), loc_f.result()
+
+def run_query(caps, loc, mode_sel, vars_sel, opt):
+    """plan -> execute (sequential: execute needs the plan)."""
     geom = {"type":"Point","lat":loc["lat"],"lon":loc["lon"]}
     # vars_sel = resolve_variable_aliases(vars_sel)
     plan = mcp_post("/plan_query", {
@@ -609,11 +878,46 @@ def run_query(use_place, mode_sel, vars_sel, opt):
         "options": opt
     })
     ex = mcp_post("/execute_plan", {"plan": plan})
-    return loc, plan, ex
+    # parse times/values once here; reruns reuse the arrays via session_state["last_result"]
+    for s in ex.get("series") or []:
+        _normalize_series(s)
+    return plan, ex
 
 def synthesize_question(place_name, mode_sel, variables):
     return synthesize_form_question(place_name, mode_sel, variables, fc_days, hist_years)
 
+def run_in_thread(fn):
+    """
+    Run `fn` on a daemon thread attached to the current script run (so
+    st.cache_* and st.session_state work inside it); returns a Future.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        fut = Future()
+        def target():
+            if not fut.set_running_or_notify_cancel():
+                return
+            try:
+                fut.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                fut.set_exception(e)
+        t = threading.Thread(target=target, daemon=True)
+        if add_script_run_ctx is not None:
+            add_script_run_ctx(t, get_script_run_ctx())
+        t.start()
+        return fut
+    return wrapper
+
+@run_in_thread
+def fetch_dataset(use_place, time_mode, variables_canon, opts):
+    """All MCP round-trips for one submit; returns the last_result tuple + dropped variables."""
+    # caps + geocode in parallel; caps is reused by the planner below
+    caps, loc = fetch_caps_and_location(use_place)
+    variables_final, dropped = filter_supported_variables(caps, variables_canon, time_mode)
+    plan, ex = run_query(caps, loc, time_mode, variables_final, opts)
+    user_q = synthesize_question(use_place, time_mode, variables_final)
+    return (use_place, loc, plan, ex, time_mode, variables_final, user_q), dropped
+
 def drive_form():
     use_place = place
     time_mode = mode
@@ -626,74 +930,107 @@ def drive_form():
     if time_mode == "historical": opts["historical_years"] = int(hist_years)
     if time_mode == "forecast":   opts["forecast_days"] = int(fc_days)
 
-    with st.spinner("Fetching data from Open-Meteo…"):
-        # NEW: get caps and filter to supported variables for this mode
-        caps = mcp_post("/describe_capabilities", {})
-        variables_final, dropped = filter_supported_variables(caps, variables_canon, time_mode)
-        if dropped:
-            st.warning(
-                "Unsupported for this mode and skipped: " + ", ".join(dropped),
-                icon="⚠️"
-            )
-
-        loc, plan, ex = run_query(use_place, time_mode, variables_final, opts)
-
-        user_q = synthesize_question(use_place, time_mode, variables_final)
-        st.session_state.last_result = (use_place, loc, plan, ex, time_mode, variables_final, user_q)
+    # off the script thread: the page stays interactive while MCP / Open-Meteo work
+    st.session_state.fetch_future = fetch_dataset(use_place, time_mode, variables_canon, opts)
 
-        # Reset sidebar chat with a short dataset-based greeting summary
-        st.session_state.chat = []
-        context = build_llm_context(use_place, plan, ex)
-        prompt = build_llm_prompt_for_summary(context, user_q)
-        llm_reply = query_llm(prompt)
-        llm_reply = clean_llm(llm_reply)
-        if llm_reply and not llm_reply.startswith("[LLM error"):
+def finish_fetch(fut):
+    """Move a finished fetch into session state; the greeting runs on the next full rerun."""
+    st.session_state.fetch_future = None
+    try:
+        result, dropped = fut.result()
+    except Exception as e:
+        st.session_state.fetch_error = str(e)
+        return
+    st.session_state.last_result = result
+    st.session_state.result_token = uuid.uuid4().hex
+    st.session_state.pop("_render_cache", None)
+    st.session_state.fetch_dropped = dropped
+    # Reset sidebar chat with a short dataset-based greeting summary
+    st.session_state.chat = []
+    st.session_state.pending_greeting = True
+
+if hasattr(st, "fragment"):
+    _fragment = st.fragment
+    def _rerun_scoped():
+        st.rerun(scope="fragment")
+
+    @st.fragment(run_every=0.5)
+    def fetch_progress():
+        """Polls the background fetch without rerunning the page; one full rerun when it lands."""
+        fut = st.session_state.get("fetch_future")
+        if fut is None:
+            return
+        if not fut.done():
+            st.status("Fetching data from Open-Meteo…", state="running")
+            return
+        finish_fetch(fut)
+        st.rerun()
+else:  # older Streamlit: no fragments, every interaction is a full rerun
+    _fragment = lambda fn: fn
+    _rerun_scoped = st.rerun
+
+    def fetch_progress():
+        with st.spinner("Fetching data from Open-Meteo…"):
+            finish_fetch(st.session_state.fetch_future)
+
+def greet_last_result():
+    place_name, loc, plan, ex, time_mode, variables_final, user_q = st.session_state.last_result
+    context = build_llm_context(place_name, plan, ex)
+    # greeting + (for multi-variable queries) one short narration per variable, in one LLM call
+    questions = [user_q]
+    if len(variables_final) > 1:
+        questions += [f"Describe the {v} in this dataset." for v in variables_final]
+    box = st.sidebar.empty()  # live view of the raw A1:/A2: reply while it streams
+    for llm_reply in query_llm_batch(context, questions, container=box):
+        if llm_reply:
             st.session_state.chat.append({"role":"assistant", "content": llm_reply})
+    box.empty()
+    # render_chat() already ran this pass; rerun the page so the new entries show as bubbles
+    st.rerun()
 
 # ---------- Summaries ----------
 def summarize_point_series(item, place_name: str, title_for_user: str):
-    df = pd.DataFrame({
-        "t": pd.to_datetime(item.get("times", [])),
-        "v": pd.to_numeric(item.get("values", []), errors="coerce")
-    }).dropna()
-    if df.empty: return []
+    t, v = _series_arrays(item)
+    ok = ~np.isnat(t) & ~np.isnan(v)
+    if not ok.any(): return []
 
     unit = (item.get("unit") or "").strip()
-    vals = df["v"].reset_index(drop=True)
-    times = df["t"].reset_index(drop=True)
-    n = len(vals)
+    arr, times = v[ok], t[ok]
+    n = arr.size
 
-    start_t, end_t = pd.to_datetime(times.iloc[0]), pd.to_datetime(times.iloc[-1])
+    start_t, end_t = pd.Timestamp(times[0]), pd.Timestamp(times[-1])
     duration_text = _format_duration(end_t - start_t)
 
-    sparse = is_sparse_series(vals)
+    sparse = is_sparse(arr)
     lines = [f"{title_for_user.capitalize()} over {place_name}",
              f"During: {start_t.strftime('%Y-%m-%d %H:%M')} → {end_t.strftime('%Y-%m-%d %H:%M')}"]
 
+    wet = arr > 0
+    nz = arr[wet]
     if sparse:
-        nz = vals[vals > 0]
-        wet_fraction = (len(nz) / n * 100.0) if n else 0.0
-        n_events = int(((vals > 0) & (vals.shift(1, fill_value=0) == 0)).sum())
+        wet_fraction = nz.size / n * 100.0
+        # rising edges: wet step after an exactly-dry one (slice views, no shifted copy)
+        n_events = int(np.count_nonzero(wet[1:] & (arr[:-1] == 0))) + int(wet[0])
         lines.append(f" Non-zero fraction: {wet_fraction:.1f}% of timesteps ({n_events} events)")
-        if len(nz):
+        if nz.size:
             lines.append(f" Mean event intensity: {nz.mean():.2f} {unit}")
             lines.append(f" Total accumulation: {nz.sum():.2f} {unit} over {duration_text}")
 
-    vmin, vmax = float(vals.min()), float(vals.max())
-    mean, std, med = float(vals.mean()), float(vals.std()), float(vals.median())
-    q25, q75 = float(vals.quantile(0.25)), float(vals.quantile(0.75))
+    vmin, vmax = float(arr.min()), float(arr.max())
+    mean = float(arr.mean())
+    std = float(arr.std(ddof=1)) if n > 1 else float("nan")  # pandas semantics
+    q25, med, q75 = (float(x) for x in np.percentile(arr, [25, 50, 75]))
     cv = (std / mean * 100.0) if mean != 0 else 0.0
     trend = "→ flat"
     if n >= 2:
-        if vals.iloc[-1] > vals.iloc[0]: trend = "↗ rising"
-        elif vals.iloc[-1] < vals.iloc[0]: trend = "↘ falling"
+        if arr[-1] > arr[0]: trend = "↗ rising"
+        elif arr[-1] < arr[0]: trend = "↘ falling"
 
     iqr_str = f"IQR {q25:.2f}–{q75:.2f} {unit}"
     is_precip_like = unit.lower().startswith("mm") or "precip" in (item.get("variable","").lower())
     if (q25 == 0.0 and q75 == 0.0) and is_precip_like:
-        nz = vals[vals > 0]
-        if len(nz) > 0:
-            nz_q25, nz_q75 = float(nz.quantile(0.25)), float(nz.quantile(0.75))
+        if nz.size > 0:
+            nz_q25, nz_q75 = (float(x) for x in np.percentile(nz, [25, 75]))
             if nz_q75 > 0:
                 iqr_str += f" (non-zero IQR ≈ {nz_q25:.2f}–{nz_q75:.2f} {unit})"
 
@@ -702,56 +1039,161 @@ def summarize_point_series(item, place_name: str, title_for_user: str):
         f"median {med:.2f} {unit}, {iqr_str}, variability {cv:.0f}%, trend {trend}"
     )
 
-    splits = [int(n * i / 4) for i in range(5)]
-    labels = ["Q1 (first quarter)", "Q2", "Q3", "Q4 (last quarter)"]
-    for i in range(4):
-        seg = vals.iloc[splits[i]:splits[i+1]]
-        if seg.empty: continue
-        seg_line = f"{labels[i]}: mean {seg.mean():.2f} {unit}, min {seg.min():.2f} {unit}, max {seg.max():.2f} {unit}"
+    # quarter stats in one reduceat pass each (empty quarters only happen for n < 4)
+    splits = np.array([int(n * i / 4) for i in range(5)])
+    sizes = np.diff(splits)
+    nonempty = sizes > 0
+    edges = splits[:-1][nonempty]
+    q_sums = np.add.reduceat(arr, edges)
+    q_means = q_sums / sizes[nonempty]
+    q_mins, q_maxs = np.minimum.reduceat(arr, edges), np.maximum.reduceat(arr, edges)
+    labels = [lab for lab, ok in zip(["Q1 (first quarter)", "Q2", "Q3", "Q4 (last quarter)"], nonempty) if ok]
+    for lab, q_mean, q_min, q_max, q_sum in zip(labels, q_means, q_mins, q_maxs, q_sums):
+        seg_line = f"{lab}: mean {q_mean:.2f} {unit}, min {q_min:.2f} {unit}, max {q_max:.2f} {unit}"
         if is_precip_like:
-            seg_line += f", total {seg.sum():.2f} {unit}"
+            seg_line += f", total {q_sum:.2f} {unit}"
         lines.append(f" {seg_line}")
 
     if is_precip_like:
-        lines.append(f" Overall total: {vals[vals>0].sum():.2f} {unit} over {duration_text}")
+        lines.append(f" Overall total: {nz.sum():.2f} {unit} over {duration_text}")
 
     return lines
 
 def summarize_box(times, values, group="hour"):
-    df = pd.DataFrame({
-        "t": pd.to_datetime(times),
-        "v": pd.to_numeric(values, errors="coerce")
-    }).dropna()
-    if df.empty:
+    # inputs are the normalized datetime64/float64 arrays: bucket them in NumPy, no re-parsing
+    times = np.asarray(times, dtype="datetime64[ns]")
+    values = np.asarray(values, dtype=np.float64)
+    ok = ~(np.isnan(values) | np.isnat(times))
+    t, v = times[ok], values[ok]
+    if v.size == 0:
         return []
-
-    df["g"] = df["t"].dt.hour if group == "hour" else df["t"].dt.month
+    if group == "hour":
+        g = (t.astype("datetime64[h]") - t.astype("datetime64[D]")).astype(np.int64)
+    else:
+        g = t.astype("datetime64[M]").astype(np.int64) % 12 + 1
+    df = pd.DataFrame({"g": g, "v": v})
     label_fn = (lambda g: f"{g:02d} UTC") if group == "hour" else \
                (lambda g: ["Jan","Feb","Mar","Apr","May","Jun","Jul",
                            "Aug","Sep","Oct","Nov","Dec"][g-1])
 
+    # every per-bucket statistic from one grouped pass
+    gv = df.groupby("g")["v"]
+    stats = gv.agg(["mean", "median"])
+    stats["q25"], stats["q75"] = gv.quantile(0.25), gv.quantile(0.75)
+    stats["frac"] = df["v"].gt(0).groupby(df["g"]).mean() * 100.0
+    pos = df[df["v"] > 0]
+    nz_q = pos.groupby("g")["v"].quantile([0.25, 0.75]).unstack() if not pos.empty else pd.DataFrame()
+
     out = []
-    for g, sub in df.groupby("g"):
-        s = sub["v"].dropna()
-        if s.empty:
-            continue
-        nz = s[s > 0]
-        frac = len(nz) / len(s) * 100.0
-        mean_all, med_all = s.mean(), s.median()
-        q25, q75 = s.quantile(0.25), s.quantile(0.75)
-        nz_iqr = None
-        if q25 == 0 and q75 == 0 and not nz.empty:
-            nz_q25, nz_q75 = nz.quantile(0.25), nz.quantile(0.75)
+    for g, row in stats.iterrows():
+        line = (f"{label_fn(g)} — non-zero freq {row.frac:.1f}%, mean {row['mean']:.2f}, "
+                f"median {row['median']:.2f}, IQR {row.q25:.2f}–{row.q75:.2f}")
+        if row.q25 == 0 and row.q75 == 0 and g in nz_q.index:
+            nz_q25, nz_q75 = nz_q.loc[g, 0.25], nz_q.loc[g, 0.75]
             if nz_q75 > 0:
-                nz_iqr = (nz_q25, nz_q75)
-        line = f"{label_fn(g)} — non-zero freq {frac:.1f}%, mean {mean_all:.2f}, median {med_all:.2f}, IQR {q25:.2f}–{q75:.2f}"
-        if nz_iqr:
-            line += f" (non-zero IQR ≈ {nz_iqr[0]:.2f}–{nz_iqr[1]:.2f})"
+                line += f" (non-zero IQR ≈ {nz_q25:.2f}–{nz_q75:.2f})"
         out.append(line)
 
     return out[:12]
 
 # ---------- Results renderer ----------
+# static blocks: built once at import, re-emitted verbatim on every rerun
+_METHOD_HTML = """
+<div class='card'><b>Method</b>
+<ul>
+  <li>Maps your free-text variables to Open-Meteo canonical parameters (no hardcoded list).</li>
+  <li>Selects current, forecast, or historical mode based on your inputs.</li>
+  <li>For sparse variables (e.g., rain), figures switch to non-zero events and summaries report event frequency & totals.</li>
+  <li>Time series can add rolling mean ± std; box plots summarize diurnal or monthly distributions.</li>
+  <li>Unsupported variables are reported explicitly—never guessed.</li>
+</ul></div>
+"""
+_STATIC_LIMITATIONS = (
+    "Regional summaries may hide local extremes.",
+    "Archive windows and grid sizes are tuned for speed on the free tier.",
+)
+_KEYWORDS_HTML = """
+<div class="card" style="background:#fff5f7cc;">
+<b>Keywords Dictionary</b><br/>
+<div style="display:grid;grid-template-columns:1fr 1fr 1fr;gap:8px;margin-top:8px;">
+  <div><b>Historical</b><br/><span class="muted small">historical, history, climatology, climate, typical, long-term, seasonal, diurnal, past</span></div>
+  <div><b>Current</b><br/><span class="muted small">now, current, present, today, live</span></div>
+  <div><b>Forecast</b><br/><span class="muted small">forecast, outlook, next, tomorrow, 5-day, 7-day, week, 10-day, 16-day</span></div>
+</div>
+</div>
+"""
+_FOOTER_HTML = """
+<div class="footer">
+  <span class="badge">Open-Meteo</span>
+  <span class="badge">MCP Server</span>
+  <div style="margin-top:6px" class="muted small">© Arka Mitra, 2025</div>
+</div>
+"""
+
+RENDER_CACHE_SIZE = 8
+
+@st.cache_data(show_spinner=False)
+def _canon2user(items: tuple) -> dict:
+    """canonical -> user-typed title, from (canonical, requested) pairs of the plan items."""
+    canon2user = {}
+    for canonical, requested in items:
+        req = requested or canonical
+        can = canonical or req
+        if req and can: canon2user[can] = req
+    return canon2user
+
+def overview_artifacts(place_name, plan, ex, viz, roll_band, roll_win, box_group):
+    """(image bytes per figure, summary lines) for the Overview tab."""
+    canon2user = _canon2user(tuple((it.get("canonical"), it.get("requested")) for it in plan.get("items", [])))
+
+    series = [s for s in (ex.get("series") or []) if _has_data(s)]
+    titles = [canon2user.get(s.get("variable",""), s.get("variable","")) for s in series]
+    viz_is_ts = viz == "Time series"
+    group_key = "hour" if box_group == "hour" else "month"
+
+    jobs, job_keys = [], []
+    for s, title in zip(series, titles):
+        t, v = _series_arrays(s)
+        job = ("ts", title, s.get("unit",""), t, v, (roll_band, roll_win)) if viz_is_ts else \
+              ("box", title, s.get("unit",""), t, v, group_key)
+        jobs.append(job)
+        job_keys.append((job[0], title, job[2], _series_fingerprint(t, v), job[5]))
+    figs = []
+    if jobs:
+        figs = render_figures(tuple(job_keys), jobs, singlecore=st.session_state.plot_singlecore)
+
+    # Summary
+    lines = []
+    for s, title in zip(series, titles):
+        if viz_is_ts:
+            lines += (summarize_point_series(s, place_name, title) or [])
+        else:
+            items = summarize_box(*_series_arrays(s), group=group_key)
+            if items:
+                lines.append(f"{title} — distribution highlights:")
+                lines += [f" {x}" for x in items]
+
+    # Aggregates
+    for a in (ex.get("aggregates") or []):
+        agg = a.get("aggregation", {})
+        mean = np.array([m if isinstance(m, (int,float)) else np.nan for m in agg.get("mean", [])], dtype=float)
+        hrs = agg.get("index", [])
+        pos = np.flatnonzero(np.isfinite(mean))
+        if pos.size:
+            unit = a.get("unit", "")
+            # positions into the unfiltered list, so they line up with `index` even with gaps
+            p_min, p_max = pos[np.argmin(mean[pos])], pos[np.argmax(mean[pos])]
+            vmin, vmax = float(mean[p_min]), float(mean[p_max])
+            try:
+                i_min = hrs[p_min]
+                i_max = hrs[p_max]
+                lines.append(f"{a['variable']} (regional diurnal): mean range {vmin:.2f}–{vmax:.2f} {unit} (min @{i_min:02d} UTC, max @{i_max:02d} UTC)")
+            except Exception:
+                lines.append(f"{a['variable']} (regional diurnal): mean range {vmin:.2f}–{vmax:.2f} {unit}")
+
+    return figs, lines
+
+@_fragment
 def render_results():
     if not st.session_state.last_result:
         st.info("Submit a query above to see results.")
@@ -774,7 +1216,6 @@ def render_results():
         st.caption(f"Using location: lat={loc['lat']:.3f}, lon={loc['lon']:.3f}, area≈{int(loc['area_km2'])} km²")
 
         # Figures
-        figs = []
         viz = st.select_slider("Plot type", ["Time series", "Box plot"], value="Time series")
         roll_band = False; roll_win = 24; box_group = "hour"
         if viz == "Time series":
@@ -784,120 +1225,61 @@ def render_results():
         else:
             box_group = st.select_slider("Box grouping", ["hour", "month"], value="hour")
 
-        # map canonical->user titles once
-        canon2user = {}
-        for it in plan.get("items", []):
-            req = it.get("requested") or it.get("canonical")
-            can = it.get("canonical") or req
-            if req and can: canon2user[can] = req
-
-        for s in (ex.get("series") or []):
-            title = canon2user.get(s.get("variable",""), s.get("variable",""))
-            if viz == "Time series":
-                figs.append(plot_time_series(title, s.get("unit",""), s.get("times",[]), s.get("values",[]),
-                                             show_roll=roll_band, win=roll_win))
-            else:
-                figs.append(plot_box(title, s.get("unit",""), s.get("times",[]), s.get("values",[]),
-                                     group=("hour" if box_group=="hour" else "month")))
+        # figures + summary lines are a pure function of (result, plot controls):
+        # chat sends and other unrelated reruns just re-emit the stored artifacts
+        key = (st.session_state.get("result_token"), viz, roll_band, roll_win, box_group)
+        cache = st.session_state.setdefault("_render_cache", OrderedDict())
+        if key in cache:
+            cache.move_to_end(key)
+        else:
+            cache[key] = overview_artifacts(place_name, plan, ex, viz, roll_band, roll_win, box_group)
+            while len(cache) > RENDER_CACHE_SIZE:
+                cache.popitem(last=False)
+        figs, lines = cache[key]
 
         if figs:
             st.markdown("<div class='card'><b>Figures</b></div>", unsafe_allow_html=True)
-            for b64 in figs:
-                img = base64.b64decode(b64)
+            for img in figs:
                 st.image(img, width='stretch')
 
-        # Summary
-        lines = []
-        for s in (ex.get("series") or []):
-            title = canon2user.get(s.get("variable",""), s.get("variable",""))
-            if viz == "Time series":
-                lines += (summarize_point_series(s, place_name, title) or [])
-            else:
-                items = summarize_box(s.get("times",[]), s.get("values",[]),
-                                      group=("hour" if box_group=="hour" else "month"))
-                if items:
-                    lines.append(f"{title} — distribution highlights:")
-                    lines += [f" {x}" for x in items]
-
-        # Aggregates
-        for a in (ex.get("aggregates") or []):
-            agg = a.get("aggregation", {})
-            mean = [m for m in agg.get("mean", []) if isinstance(m, (int,float))]
-            hrs = agg.get("index", [])
-            if mean:
-                unit = a.get("unit", "")
-                vmin, vmax = min(mean), max(mean)
-                try:
-                    i_min = hrs[mean.index(vmin)]
-                    i_max = hrs[mean.index(vmax)]
-                    lines.append(f"{a['variable']} (regional diurnal): mean range {vmin:.2f}–{vmax:.2f} {unit} (min @{i_min:02d} UTC, max @{i_max:02d} UTC)")
-                except Exception:
-                    lines.append(f"{a['variable']} (regional diurnal): mean range {vmin:.2f}–{vmax:.2f} {unit}")
-
+        # Summary / Method / Source / Limitations: one HTML element instead of four
+        cards = []
         if lines:
-            st.markdown("<div class='card'><b>Summary</b><ul>" +
-                        "".join(f"<li>{ln}</li>" for ln in lines) +
-                        "</ul></div>", unsafe_allow_html=True)
-
-        # Method / Source / Limitations
-        st.markdown("""
-        <div class='card'><b>Method</b>
-        <ul>
-          <li>Maps your free-text variables to Open-Meteo canonical parameters (no hardcoded list).</li>
-          <li>Selects current, forecast, or historical mode based on your inputs.</li>
-          <li>For sparse variables (e.g., rain), figures switch to non-zero events and summaries report event frequency & totals.</li>
-          <li>Time series can add rolling mean ± std; box plots summarize diurnal or monthly distributions.</li>
-          <li>Unsupported variables are reported explicitly—never guessed.</li>
-        </ul></div>
-        """, unsafe_allow_html=True)
+            cards.append("<div class='card'><b>Summary</b><ul>" +
+                         "".join(f"<li>{ln}</li>" for ln in lines) + "</ul></div>")
+        cards.append(_METHOD_HTML.strip())
 
         links = openmeteo_doc_links(time_mode)
         citations = ex.get("citations") or []
-        src_html = "<div class='card'><b>Source</b><br/>"
-        for c in citations:
-            src_html += f" {c}<br/>"
-        for label, url in links:
-            src_html += f" {label} — <a href='{url}' target='_blank'>{url}</a><br/>"
-        src_html += "</div>"
-        st.markdown(src_html, unsafe_allow_html=True)
-
-        lims = (ex.get("limitations") or []) + [
-            "Regional summaries may hide local extremes.",
-            "Archive windows and grid sizes are tuned for speed on the free tier."
-        ]
-        st.markdown("<div class='card'><b>Limitations</b><ul>" +
-                    "".join(f"<li>{ln}</li>" for ln in lims[:8]) +
-                    "</ul></div>", unsafe_allow_html=True)
+        cards.append("<div class='card'><b>Source</b><br/>" +
+                     "".join(f" {c}<br/>" for c in citations) +
+                     "".join(f" {label} — <a href='{url}' target='_blank'>{url}</a><br/>" for label, url in links) +
+                     "</div>")
+
+        lims = [*(ex.get("limitations") or []), *_STATIC_LIMITATIONS]
+        cards.append("<div class='card'><b>Limitations</b><ul>" +
+                     "".join(f"<li>{ln}</li>" for ln in lims[:8]) + "</ul></div>")
+        st.markdown("<div class='card-stack'>" + "\n".join(cards) + "</div>", unsafe_allow_html=True)
 
     with tabs[1]:
         st.markdown("<div class='download-wrap'>**Download data**</div>", unsafe_allow_html=True)
-        series = ex.get("series") or []
-        combined = build_combined_df(series)
-        if not combined.empty:
-            st.download_button(
-                "Download combined CSV",
-                data=df_to_csv_bytes(combined),
-                file_name=f"{place_name.replace(' ','_')}_combined.csv",
-                mime="text/csv",
-                key="dl_combined"
-            )
-        for s in series:
-            var = s.get("variable","series")
-            t = pd.to_datetime(s.get("times", []))
-            v = pd.to_numeric(pd.Series(s.get("values", [])), errors="coerce")
-            df = pd.DataFrame({"time": t, var: v}).dropna()
-            if df.empty: 
-                continue
-            st.download_button(
-                f"Download {var} CSV",
-                data=df_to_csv_bytes(df),
-                file_name=f"{place_name.replace(' ','_')}_{var.replace(' ','_')}.csv",
-                mime="text/csv",
-                key=f"dl_{var}"
-            )
+        series = [s for s in (ex.get("series") or []) if _has_data(s)]
+        prints = tuple((s.get("variable","series"), _series_fingerprint(*_series_arrays(s))) for s in series)
+        fmt = "csv"
+        if series and len(DOWNLOAD_FORMATS) > 1:
+            fmt = st.selectbox("Format", list(_FORMAT_INFO), format_func=lambda f: _FORMAT_INFO[f][1], key="dl_fmt")
+        if series:
+            _download_button("Download combined", f"{place_name.replace(' ','_')}_combined", "dl_combined", fmt,
+                             lambda fmt: _combined_download(prints, fmt, series))
+        for s, (var, fp) in zip(series, prints):
+            t, v = _series_arrays(s)
+            _download_button(f"Download {var}", f"{place_name.replace(' ','_')}_{var.replace(' ','_')}", f"dl_{var}", fmt,
+                             lambda fmt, var=var, fp=fp, t=t, v=v: _series_download(var, fp, fmt, t, v))
 
 ## ---------- Sidebar Chat (dataset-scoped, styled) ----------
-with st.sidebar:
+@_fragment
+def render_chat():
+    """Sidebar chat. As a fragment, send/clear rerun only the chat, not the results page."""
     st.markdown("<h4>💬 Meteo-Chat</h4>", unsafe_allow_html=True)
 
     if st.session_state.last_result:
@@ -906,13 +1288,14 @@ with st.sidebar:
     else:
         context = None
 
-    # render chat bubbles
-    for m in st.session_state.chat:
-        bubble_color = "#fff0f5" if m["role"] == "user" else "#ffe6f0"
-        align = "right" if m["role"] == "user" else "left"
+    # render chat bubbles: one markdown element for the whole history, styled by the page CSS
+    if st.session_state.chat:
         st.markdown(
-            f"<div style='background:{bubble_color};padding:10px 14px;border-radius:12px;"
-            f"margin:4px 0;text-align:{align};font-size:0.95rem;'>{html.escape(m['content'])}</div>",
+            "".join(
+                f"<div class='bubble bubble-{'user' if m['role'] == 'user' else 'assistant'}'>"
+                f"{html.escape(m['content'])}</div>"
+                for m in st.session_state.chat
+            ),
             unsafe_allow_html=True
         )
 
@@ -934,57 +1317,44 @@ with st.sidebar:
 
     if clear_clicked:
         st.session_state.chat = []
-        st.rerun()
+        _rerun_scoped()
 
     if send_clicked and user_msg.strip():
         msg = user_msg.strip()
         st.session_state.chat.append({"role": "user", "content": msg})
         prompt = build_llm_prompt_for_chat(context, st.session_state.chat, msg)
-        reply = query_llm(prompt)
-        reply = clean_llm(reply)
+        # the prompt carries the earlier turns, so they belong in the cache key: a follow-up
+        # ("what about tomorrow?") only reuses replies from the same conversation state
+        chat_key = f"{context}\n\nRECENT CHAT:\n{_history_text(st.session_state.chat[-4:-1])}"
+        reply = query_llm(prompt, container=st.empty(), context=chat_key, question=msg)
         st.session_state.chat.append({"role": "assistant", "content": reply})
 
         # Instead of touching widget state, just trigger refresh
         st.experimental_set_query_params(_=datetime.now().timestamp())
-        st.rerun()
+        _rerun_scoped()
 
-    # subtle style tweak for icon buttons
-    st.markdown(
-        """
-        <style>
-        div[data-testid="stHorizontalBlock"] button {
-            margin-top: -6px !important;
-            height: 2.2rem !important;
-            font-size: 1.3rem !important;
-        }
-        </style>
-        """,
-        unsafe_allow_html=True,
-    )
+with st.sidebar:
+    render_chat()
 
 # ---------- Triggers ----------
 if go_form:
     drive_form()
+if st.session_state.get("fetch_future") is not None:
+    fetch_progress()
+if st.session_state.get("fetch_error"):
+    st.error(st.session_state.pop("fetch_error"))
+if st.session_state.get("fetch_dropped"):
+    st.warning(
+        "Unsupported for this mode and skipped: " + ", ".join(st.session_state.pop("fetch_dropped")),
+        icon="⚠️"
+    )
+if st.session_state.pop("pending_greeting", False):
+    greet_last_result()
 
 render_results()
 
 # ---------- Bottom: Keywords Dictionary ----------
-st.markdown("""
-<div class="card" style="background:#fff5f7cc;">
-<b>Keywords Dictionary</b><br/>
-<div style="display:grid;grid-template-columns:1fr 1fr 1fr;gap:8px;margin-top:8px;">
-  <div><b>Historical</b><br/><span class="muted small">historical, history, climatology, climate, typical, long-term, seasonal, diurnal, past</span></div>
-  <div><b>Current</b><br/><span class="muted small">now, current, present, today, live</span></div>
-  <div><b>Forecast</b><br/><span class="muted small">forecast, outlook, next, tomorrow, 5-day, 7-day, week, 10-day, 16-day</span></div>
-</div>
-</div>
-""", unsafe_allow_html=True)
+st.markdown(_KEYWORDS_HTML, unsafe_allow_html=True)
 
 # ---------- Footer ----------
-st.markdown("""
-<div class="footer">
-  <span class="badge">Open-Meteo</span>
-  <span class="badge">MCP Server</span>
-  <div style="margin-top:6px" class="muted small">© Arka Mitra, 2025</div>
-</div>
-""", unsafe_allow_html=True)
\ No newline at end of file
+st.markdown(_FOOTER_HTML, unsafe_allow_html=True)
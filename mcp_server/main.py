@@ -4,15 +4,21 @@ Minimal MCP server stub so `python -m mcp_server.main` works.
 Replace with your actual server startup logic (FastAPI, Flask, etc.).
 """
 
-import time
+import signal
+import sys
+import threading
 
 def main():
+    # SIGTERM (cli.py's terminate(), container stop) exits right away instead of waiting for the kill
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
     print("[mcp_server] server started on http://127.0.0.1:8787")
     try:
-        while True:
-            time.sleep(3600)
-    except KeyboardInterrupt:
+        if hasattr(signal, "pause"):
+            signal.pause()  # block, zero wakeups, until a signal arrives
+        else:  # Windows has no signal.pause
+            threading.Event().wait()
+    except (KeyboardInterrupt, SystemExit):
         print("[mcp_server] shutting down...")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,37 @@
+# meteo_chat/batching.py
+"""
+Several questions about one dataset context in a single LLM call.
+
+The context is shipped once; the model answers on labeled lines (A1:, A2:, ...)
+that split_batched_reply() maps back to the questions.
+"""
+import re
+
+
+def build_batched_prompt(context: str, questions: list[str]):
+    """Several questions over one context: the (long) context is shipped once."""
+    numbered = "\n".join(f"Q{i}: {q}" for i, q in enumerate(questions, 1))
+    return (
+        "You are Meteo-Chat. Use ONLY the dataset below. "
+        "Answer each question in 2–4 conversational sentences with clear numbers + units. "
+        "Put each answer on its own line, prefixed A1:, A2:, … matching the question numbers. "
+        "Do not include any preamble, system text, or the words USER/ASSISTANT. "
+        "Do not repeat the context. No hashtags. No disclaimers.\n\n"
+        f"{context}\n\n"
+        f"{numbered}\n"
+        "ASSISTANT (answer only):"
+    )
+
+
+_RE_BATCH_LABEL = re.compile(r"^\s*A(\d+)\s*:", re.M)
+
+
+def split_batched_reply(reply: str, n: int) -> list:
+    """Per-question answers from an A1:/A2: reply (None where an answer is missing or unlabeled)."""
+    out = [None] * n
+    pieces = _RE_BATCH_LABEL.split(reply or "")
+    for num, text in zip(pieces[1::2], pieces[2::2]):
+        k = int(num) - 1
+        if 0 <= k < n and out[k] is None:
+            out[k] = text.strip() or None
+    return out
@@ -23,10 +23,10 @@ DEFAULT_MCP_URL = os.environ.get("MCP_URL", "http://127.0.0.1:8787")
 DEFAULT_LLM_BASE = os.environ.get("LLM_BASE", "http://127.0.0.1:8899")
 DEFAULT_LLM_URL  = os.environ.get("LLM_URL", f"{DEFAULT_LLM_BASE}/generate")
 
-# Strong default for your local adapter (no user export needed)
+# Default to the adapter shipped in this checkout (no user export needed)
 DEFAULT_ADAPTER_PATH = os.environ.get(
     "ADAPTER_PATH",
-    "/Users/mitra/vibe_code/weatherai/artifacts/adapter"
+    str(ROOT / "artifacts" / "adapter")
 )
 
 APP_HOST = "127.0.0.1"
@@ -57,25 +57,33 @@ def _wait_http_ok(url: str, timeout=60):
     """
     Poll a URL until it returns a 2xx status or timeout.
     Useful for hitting /health on the LLM server.
+    One keep-alive connection is reused across probes; it is only rebuilt
+    after a failure (e.g. refused while the server is still booting).
     """
-    parsed = urllib.parse.urlparse(url)
+    parsed = urllib.parse.urlsplit(url)
     scheme = parsed.scheme or "http"
     host = parsed.hostname or "127.0.0.1"
     port = parsed.port or (443 if scheme == "https" else 80)
     path = parsed.path or "/"
-    t0 = time.time()
+    conn_cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+    conn = conn_cls(host, port, timeout=3)
+    deadline = time.monotonic() + timeout
 
-    while time.time() - t0 < timeout:
-        try:
-            conn = http.client.HTTPConnection(host, port, timeout=3)
-            conn.request("GET", path)
-            resp = conn.getresponse()
-            if 200 <= resp.status < 300:
-                return True
-        except Exception:
-            pass
-        time.sleep(0.5)
-    return False
+    try:
+        while time.monotonic() < deadline:
+            try:
+                conn.request("GET", path)
+                resp = conn.getresponse()
+                resp.read()  # drain so the connection can carry the next probe
+                if 200 <= resp.status < 300:
+                    return True
+            except Exception:
+                conn.close()
+                conn = conn_cls(host, port, timeout=3)
+            time.sleep(0.1)
+        return False
+    finally:
+        conn.close()
 
 
 def _env_with_defaults():
@@ -89,11 +97,11 @@ def _env_with_defaults():
 # ---- LLM launcher ------------------------------------------------------------
 def run_llm():
     """
-    Start the FastAPI LLM service (weatherai.agent.llm_service).
-    Forces ADAPTER_PATH to your local artifacts; binds to 127.0.0.1:8899.
+    Start the FastAPI LLM service (agent.llm_service).
+    Points ADAPTER_PATH at the repo artifacts unless set; binds to 127.0.0.1:8899.
     """
     env = os.environ.copy()
-    env["ADAPTER_PATH"] = DEFAULT_ADAPTER_PATH     # hard default so user doesn't export
+    env.setdefault("ADAPTER_PATH", DEFAULT_ADAPTER_PATH)
     env.setdefault("LLM_PORT", str(LLM_DEFAULT_PORT))
 
     # Use module execution so imports resolve from installed package
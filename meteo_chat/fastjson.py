@@ -0,0 +1,31 @@
+# meteo_chat/fastjson.py
+"""
+JSON encode/decode for the hot paths (MCP bodies, cache keys, LLM stream).
+
+Uses orjson when installed (several times faster on the large execute_plan
+payloads), else the stdlib. Both produce compact output; keys are sorted
+only when asked for.
+"""
+import json
+from typing import Any
+
+try:
+    import orjson  # optional
+except Exception:
+    orjson = None
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> str:
+    if orjson is not None:
+        opt = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            opt |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=opt, default=str).decode("utf-8")
+    return json.dumps(obj, sort_keys=sort_keys, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def loads(data) -> Any:
+    """Parse str or bytes (e.g. `response.content`, skipping the text decode)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
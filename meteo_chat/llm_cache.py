@@ -0,0 +1,127 @@
+# meteo_chat/llm_cache.py
+"""
+Semantic cache for LLM replies.
+
+Rows are keyed on the sha256 of the dataset context. A lookup only looks at
+rows for the same context, and returns a cached reply when the question
+embedding is close enough (cosine >= threshold). Paraphrased follow-ups
+("how windy is it?" / "what's the wind like?") then skip the LLM round-trip.
+Numbers and aggregate words (max/min/mean, today/tomorrow, ...) must match
+exactly too: "max temperature" and "min temperature" embed almost the same.
+Without an embedding, only an identical question counts as a hit.
+
+Contexts carry fetch-specific stats, so most submits add fresh rows: rows older
+than `ttl` are ignored and pruned, and the table is capped at `max_rows`
+(oldest first). Re-putting the same context + question replaces the row.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.getenv("METEO_CHAT_CACHE_DIR", os.path.expanduser("~/.cache/meteo-chat"))
+
+DEFAULT_TTL_S = 7 * 24 * 3600
+DEFAULT_MAX_ROWS = 20000
+PRUNE_EVERY = 100  # puts between prunes
+
+
+# words that flip a numeric answer while barely moving the embedding
+SALIENT_WORDS = frozenset({
+    "max", "maximum", "min", "minimum", "mean", "average", "avg", "median", "total", "sum",
+    "std", "range", "highest", "lowest", "hottest", "coldest", "warmest", "coolest",
+    "wettest", "driest", "peak", "first", "last", "today", "tomorrow", "yesterday",
+    "morning", "afternoon", "evening", "night", "day", "week", "month", "year",
+})
+_NUM_RE = re.compile(r"\d+(?:\.\d+)?")
+_WORD_RE = re.compile(r"[a-z]+")
+
+
+def salient_terms(question: str):
+    """Numbers (in order) + aggregate/time words; a semantic hit needs these to be equal."""
+    q = question.lower()
+    return tuple(_NUM_RE.findall(q)), frozenset(w for w in _WORD_RE.findall(q) if w in SALIENT_WORDS)
+
+
+def context_key(context: str) -> str:
+    return hashlib.sha256(context.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path: str, threshold: float = 0.95,
+                 ttl: float = DEFAULT_TTL_S, max_rows: int = DEFAULT_MAX_ROWS):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._puts = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # shared across Streamlit sessions (threads) -> one connection behind a lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " ctx_sha256 TEXT NOT NULL, question TEXT NOT NULL,"
+                " embedding BLOB, response TEXT NOT NULL, ts REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_ctx ON llm_cache (ctx_sha256)")
+            # older files may hold duplicate questions: keep the newest before adding the unique key
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE rowid NOT IN ("
+                " SELECT MAX(rowid) FROM llm_cache GROUP BY ctx_sha256, question)"
+            )
+            self._conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS llm_cache_ctx_q ON llm_cache (ctx_sha256, question)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_ts ON llm_cache (ts)")
+            self._prune()
+
+    def get(self, context: str, question: str, q_vec: Optional[np.ndarray] = None) -> Optional[str]:
+        """Best cached reply for this context + question, or None."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT question, embedding, response FROM llm_cache WHERE ctx_sha256 = ? AND ts >= ?",
+                (context_key(context), time.time() - self.ttl),
+            ).fetchall()
+        if not rows:
+            return None
+        for q, _, resp in rows:
+            if q == question:
+                return resp
+        if q_vec is None:
+            return None
+        terms = salient_terms(question)
+        cands = [(np.frombuffer(emb, dtype=np.float32), q, resp) for q, emb, resp in rows
+                 if emb is not None and len(emb) == q_vec.nbytes and salient_terms(q) == terms]
+        if not cands:
+            return None
+        # embeddings are stored unit-normalized: one matmul gives every cosine
+        sims = np.vstack([e for e, _, _ in cands]) @ q_vec
+        best = int(np.argmax(sims))
+        return cands[best][2] if sims[best] >= self.threshold else None
+
+    def put(self, context: str, question: str, response: str, q_vec: Optional[np.ndarray] = None) -> None:
+        emb = None if q_vec is None else np.asarray(q_vec, dtype=np.float32).tobytes()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (ctx_sha256, question, embedding, response, ts)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (context_key(context), question, emb, response, time.time()),
+            )
+            self._puts += 1
+            if self._puts % PRUNE_EVERY == 0:
+                self._prune()
+
+    def _prune(self) -> None:
+        """Drop expired rows, then the oldest beyond max_rows. Caller holds the lock + transaction."""
+        self._conn.execute("DELETE FROM llm_cache WHERE ts < ?", (time.time() - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM llm_cache WHERE rowid IN ("
+            " SELECT rowid FROM llm_cache ORDER BY ts DESC LIMIT -1 OFFSET ?)",
+            (self.max_rows,),
+        )
@@ -0,0 +1,84 @@
+# meteo_chat/mcp_cache.py
+"""
+Content-addressed on-disk cache for MCP responses.
+
+Keys are (endpoint, blake2b of the canonical JSON payload), so the same
+request hits regardless of dict key order, across app restarts and across
+processes sharing the cache dir. Each endpoint has its own TTL.
+"""
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Optional
+
+from meteo_chat import fastjson
+from meteo_chat.llm_cache import DEFAULT_CACHE_DIR
+
+DEFAULT_PATH = os.path.join(DEFAULT_CACHE_DIR, "mcp_cache.sqlite")  # shared by the app and the builders
+
+BUSY_TIMEOUT_S = 30.0
+
+# seconds; endpoints not listed are not cached
+DEFAULT_TTLS = {
+    "/describe_capabilities": 24 * 3600,  # near-static
+    "/resolve_location": 24 * 3600,
+    "/plan_query": 3600,
+    "/execute_plan": 3600,                 # historical windows rarely move within an hour
+}
+
+
+def payload_key(ep: str, payload: Any) -> str:
+    blob = fastjson.dumps(payload, sort_keys=True)
+    return f"{ep}:{hashlib.blake2b(blob.encode('utf-8'), digest_size=16).hexdigest()}"
+
+
+class MCPCache:
+    def __init__(self, path: str, ttls: Optional[dict] = None, verbose: bool = False):
+        self.ttls = DEFAULT_TTLS if ttls is None else ttls
+        self.verbose = verbose
+        self.hits = self.misses = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # shared across Streamlit sessions (threads) -> one connection behind a lock;
+        # builder worker processes share the file too: WAL lets readers run during a write,
+        # and a busy timeout makes writers wait for the lock instead of "database is locked"
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=BUSY_TIMEOUT_S)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA busy_timeout={int(BUSY_TIMEOUT_S * 1000)}")
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS mcp_cache ("
+                " key TEXT PRIMARY KEY, body TEXT NOT NULL, ts REAL NOT NULL)"
+            )
+
+    def get(self, ep: str, payload: Any) -> Optional[Any]:
+        ttl = self.ttls.get(ep)
+        if not ttl:
+            return None
+        key = payload_key(ep, payload)
+        with self._lock:
+            row = self._conn.execute("SELECT body, ts FROM mcp_cache WHERE key = ?", (key,)).fetchone()
+        hit = row is not None and time.time() - row[1] < ttl
+        self._count(ep, hit)
+        return fastjson.loads(row[0]) if hit else None
+
+    def put(self, ep: str, payload: Any, body: Any) -> None:
+        if not self.ttls.get(ep):
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO mcp_cache (key, body, ts) VALUES (?, ?, ?)",
+                (payload_key(ep, payload), fastjson.dumps(body), time.time()),
+            )
+
+    def _count(self, ep: str, hit: bool) -> None:
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        if self.verbose:
+            print(f"[mcp-cache] {'hit ' if hit else 'miss'} {ep} (hits={self.hits} misses={self.misses})",
+                  file=sys.stderr, flush=True)
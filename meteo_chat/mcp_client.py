@@ -1,17 +1,61 @@
 # meteo_chat/mcp_client.py
+import errno
+import select
 import time
 import socket
 import requests
 
-def wait_for_port(host: str, port: int, timeout: float = 30.0) -> bool:
-    start = time.time()
-    while time.time() - start < timeout:
+_IN_PROGRESS = {errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, 10035}  # 10035: WSAEWOULDBLOCK
+
+def _probe(infos, wait: float) -> bool:
+    """
+    Non-blocking connect to every getaddrinfo() result at once (e.g. ::1 and 127.0.0.1
+    for localhost); select() wakes on the first SYN-ACK instead of sleeping a fixed slice.
+    """
+    socks, pending = [], []
+    try:
+        for family, _, _, _, addr in infos:
+            try:
+                s = socket.socket(family, socket.SOCK_STREAM)
+            except OSError:
+                continue
+            socks.append(s)
+            s.setblocking(False)
+            err = s.connect_ex(addr)
+            if err == 0:
+                return True
+            if err in _IN_PROGRESS:
+                pending.append(s)
+        deadline = time.monotonic() + wait
+        while pending:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return False
+            _, writable, _ = select.select([], pending, [], left)
+            if not writable:
+                return False
+            for s in writable:
+                if s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                    return True
+                pending.remove(s)  # refused on this address; keep waiting on the others
+        return False
+    finally:
+        for s in socks:
+            s.close()
+
+def wait_for_port(host: str, port: int, timeout: float = 30.0, interval: float = 0.05) -> bool:
+    deadline = time.monotonic() + timeout
+    while True:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            return False
         try:
-            with socket.create_connection((host, port), timeout=1.0):
+            if _probe(socket.getaddrinfo(host, port, type=socket.SOCK_STREAM), min(1.0, left)):
                 return True
         except OSError:
-            time.sleep(0.25)
-    return False
+            pass
+        # refused (nothing listening yet) comes back instantly: retry quickly
+        time.sleep(min(interval, max(0.0, deadline - time.monotonic())))
 
 def is_http_healthy(url: str, timeout: float = 2.0) -> bool:
     try:
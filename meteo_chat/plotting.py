@@ -0,0 +1,176 @@
+# meteo_chat/plotting.py
+"""
+Matplotlib renderers for the Streamlit app.
+
+Kept in an importable module (not the app script) so they can run in a
+worker process: every function here is a pure function of its arguments
+(datetime64 times, float64 values) and returns raw image bytes (WebP, or PNG). Rendering
+never touches pyplot state, so worker threads are fine too.
+"""
+import io
+import os
+import threading
+
+import matplotlib
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import numpy as np
+import pandas as pd
+
+from meteo_chat.rolling import rolling_mean_std
+
+try:
+    import lttbc  # C implementation of LTTB (optional)
+except Exception:
+    lttbc = None
+
+# ~1400 px of plot width at 150 DPI: more points than this are invisible
+LTTB_THRESHOLD = 3000
+LTTB_POINTS = 2000
+
+def _webp_available() -> bool:
+    try:
+        from PIL import features
+        return bool(features.check("webp"))
+    except Exception:
+        return False
+
+# WebP encodes faster and ~40% smaller than PNG's zlib for these flat-colour line plots;
+# METEO_CHAT_FIG_FORMAT=png forces the old output (or Pillow lacks libwebp)
+FIG_FORMAT = os.getenv("METEO_CHAT_FIG_FORMAT", "webp").lower()
+if FIG_FORMAT not in ("webp", "png") or (FIG_FORMAT == "webp" and not _webp_available()):
+    FIG_FORMAT = "png"
+
+# long hourly series: let Agg merge near-collinear segments (per render, via rc_context)
+_RC = {"path.simplify_threshold": 1.0}
+
+_local = threading.local()
+
+def _get_axes(size=(9.5, 3.6)):
+    """
+    One Figure/Axes per thread (and so per worker process), cleared between
+    plots instead of allocating a new canvas each time. Built without pyplot
+    so nothing accumulates in pyplot's figure manager.
+    """
+    if getattr(_local, "fig", None) is None:
+        fig = Figure(figsize=size)
+        FigureCanvasAgg(fig)
+        # fixed margins instead of tight_layout/bbox_inches="tight" (each costs an extra draw)
+        fig.subplots_adjust(left=0.08, right=0.98, top=0.9, bottom=0.18)
+        _local.fig, _local.ax = fig, fig.add_subplot(111)
+    _local.ax.clear()
+    return _local.fig, _local.ax
+
+def fig_to_image(fig) -> bytes:
+    """Encoded image bytes (PNG, or WebP per FIG_FORMAT), ready for st.image."""
+    buf = io.BytesIO()
+    if FIG_FORMAT == "webp":
+        # lossy at q=90: no visible ringing on thin lines, much cheaper than lossless
+        fig.savefig(buf, format="webp", dpi=150, pil_kwargs={"quality": 90, "method": 4})
+    else:
+        fig.savefig(buf, format="png", dpi=150)
+    return buf.getvalue()
+
+def is_sparse(arr: np.ndarray, thresh=0.05) -> bool:
+    """True when at most `thresh` of the samples are > 0 (NaN counts as zero)."""
+    if arr.size == 0:
+        return False
+    return np.count_nonzero(arr > 0) <= thresh * arr.size
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int):
+    """Largest-Triangle-Three-Buckets downsample of finite (x, y) to n_out points."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+    if lttbc is not None:
+        return lttbc.downsample(x, y, n_out)
+    idx = np.empty(n_out, dtype=np.intp)
+    idx[0], idx[-1] = 0, n - 1
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)  # n_out-2 buckets between first/last
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            nxt = slice(edges[i + 1], edges[i + 2])
+            avg_x, avg_y = x[nxt].mean(), y[nxt].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        # point in this bucket forming the largest triangle with the last pick and next bucket's mean
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        idx[i + 1] = a
+    return x[idx], y[idx]
+
+def _downsample_raw(t: pd.DatetimeIndex, s: pd.Series):
+    """Visually equivalent raw trace for long series; untouched below LTTB_THRESHOLD."""
+    if len(s) <= LTTB_THRESHOLD:
+        return t, s
+    v = s.to_numpy(dtype=np.float64)
+    ok = np.isfinite(v)
+    x_ds, y_ds = lttb(t.asi8[ok].astype(np.float64), v[ok], LTTB_POINTS)
+    return pd.DatetimeIndex(np.asarray(x_ds).astype(np.int64).view("datetime64[ns]")), np.asarray(y_ds)
+
+@matplotlib.rc_context(_RC)
+def render_time_series(title, unit, times, values, show_roll=False, win=24) -> bytes:
+    """Line plot (optionally rolling mean ± 1σ) as encoded image bytes."""
+    t = pd.DatetimeIndex(np.asarray(times, dtype="datetime64[ns]"))
+    s = pd.Series(np.asarray(values, dtype=np.float64))
+    sparse = is_sparse(s.to_numpy())
+    if sparse:
+        mask = s > 0
+        t = t[mask]; s = s[mask]
+    fig, ax = _get_axes()
+    if show_roll and len(s) > win:
+        # rolling stats on the full series; the smooth band only needs a stride slice
+        rm, rs = rolling_mean_std(s.to_numpy(dtype=np.float64), win, max(3, win//4))
+        step = max(1, len(s) // LTTB_POINTS) if len(s) > LTTB_THRESHOLD else 1
+        tt, rm, rs = t[::step], rm[::step], rs[::step]
+        ax.fill_between(tt, rm - rs, rm + rs, alpha=0.18, label="±1σ")
+        ax.plot(tt, rm, linewidth=1.8, label="Rolling mean")
+        ax.plot(*_downsample_raw(t, s), alpha=0.35, linewidth=0.9, label="Raw")
+        ax.legend()
+    else:
+        ax.plot(*_downsample_raw(t, s))
+    ax.set_title(title + (" (non-zero events)" if sparse else ""))
+    ax.set_xlabel("Time"); ax.set_ylabel(unit or ""); ax.tick_params(axis="x", labelrotation=15)
+    return fig_to_image(fig)
+
+@matplotlib.rc_context(_RC)
+def render_box(title, unit, times, values, group="hour") -> bytes:
+    """Diurnal (group="hour") or monthly box plot as encoded image bytes."""
+    df = pd.DataFrame({"t": np.asarray(times, dtype="datetime64[ns]"),
+                       "v": np.asarray(values, dtype=np.float64)}).dropna()
+    fig, ax = _get_axes()
+    if df.empty:
+        ax.set_title(title + " (no data)")
+        return fig_to_image(fig)
+    sparse = is_sparse(df["v"].to_numpy())
+    if sparse:
+        df = df[df["v"] > 0]
+    if df.empty:
+        ax.set_title(title + " (no non-zero events)")
+        return fig_to_image(fig)
+    df["g"] = df["t"].dt.hour if group == "hour" else df["t"].dt.month
+    order = sorted(df["g"].unique())
+    groups = [df.loc[df.g==g, "v"].values for g in order]
+    labels = [f"{g:02d}" if group=="hour" else
+              ["Jan","Feb","Mar","Apr","May","Jun","Jul","Aug","Sep","Oct","Nov","Dec"][g-1]
+              for g in order]
+    bp = ax.boxplot(groups, labels=labels, patch_artist=True, showfliers=False,
+                    medianprops=dict(color="#9c1749"))
+    for p in bp["boxes"]:
+        p.set_facecolor("#f6a3c5"); p.set_alpha(0.35); p.set_edgecolor("#b91c57")
+    ax.set_ylabel(unit or "")
+    ax.set_title(title + (" (non-zero events)" if sparse else "") +
+                 (" (diurnal)" if group=="hour" else " (monthly)"))
+    ax.set_xlabel("Hour (UTC)" if group=="hour" else "Month")
+    return fig_to_image(fig)
+
+
+def render_job(job) -> bytes:
+    """Picklable entry point for a pool: job = (kind, title, unit, times, values, opt) -> image bytes."""
+    kind, title, unit, times, values, opt = job
+    if kind == "ts":
+        show_roll, win = opt
+        return render_time_series(title, unit, times, values, show_roll=show_roll, win=win)
+    return render_box(title, unit, times, values, group=opt)
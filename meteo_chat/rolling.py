@@ -0,0 +1,63 @@
+# meteo_chat/rolling.py
+"""
+Single-pass rolling mean / std for the time-series plots.
+
+With numba installed, one jitted sweep emits both outputs (running Welford
+add/remove over the window). Without numba, falls back to pandas rolling.
+Semantics match pandas: trailing window, NaNs skipped, std with ddof=1.
+"""
+import numpy as np
+import pandas as pd
+
+try:
+    from numba import njit
+except Exception:  # numba is optional
+    njit = None
+
+
+def _rolling_mean_std_kernel(x, win, min_periods):
+    n = x.shape[0]
+    mean_out = np.full(n, np.nan)
+    std_out = np.full(n, np.nan)
+    nobs = 0
+    mean = 0.0
+    m2 = 0.0
+    for i in range(n):
+        v = x[i]
+        if not np.isnan(v):
+            nobs += 1
+            d = v - mean
+            mean += d / nobs
+            m2 += d * (v - mean)
+        if i >= win:
+            old = x[i - win]
+            if not np.isnan(old):
+                nobs -= 1
+                if nobs == 0:
+                    mean = 0.0
+                    m2 = 0.0
+                else:
+                    d = old - mean
+                    mean -= d / nobs
+                    m2 -= d * (old - mean)
+        if nobs >= min_periods and nobs > 0:
+            mean_out[i] = mean
+            if nobs > 1:
+                std_out[i] = np.sqrt(max(m2, 0.0) / (nobs - 1))
+    return mean_out, std_out
+
+
+# no fastmath: it would let LLVM assume away the NaN checks above
+_kernel = njit(cache=True, nogil=True)(_rolling_mean_std_kernel) if njit is not None else None
+if _kernel is not None:
+    # compile (or load from the on-disk cache) at import, not on the first plot
+    _kernel(np.zeros(2), 2, 1)
+
+
+def rolling_mean_std(values, win: int, min_periods: int):
+    """Return (rolling_mean, rolling_std) as float64 arrays, same length as `values`."""
+    x = np.ascontiguousarray(values, dtype=np.float64)
+    if _kernel is not None:
+        return _kernel(x, int(win), int(min_periods))
+    r = pd.Series(x).rolling(win, min_periods=min_periods)
+    return r.mean().to_numpy(), r.std().to_numpy()
@@ -0,0 +1,71 @@
+# meteo_chat/series.py
+"""
+MCP series payloads as numpy arrays, and the wide frame the downloads use.
+
+A series dict's JSON lists are parsed once into s["_t"] / s["_v"]; plots,
+summaries and downloads all read those.
+"""
+import numpy as np
+import pandas as pd
+
+
+def normalize_series(s: dict) -> dict:
+    """
+    Parse a series' JSON lists once into s["_t"] (datetime64[ns]) and
+    s["_v"] (float64, None -> NaN). Everything downstream reads these.
+    """
+    times, values = s.get("times") or [], s.get("values") or []
+    try:
+        t = np.asarray(times, dtype="datetime64[ns]")
+    except (TypeError, ValueError):  # offsets / odd formats: let pandas parse, keep UTC
+        t = pd.to_datetime(times, utc=True).tz_localize(None).to_numpy(dtype="datetime64[ns]")
+    try:
+        v = np.fromiter((np.nan if x is None else x for x in values), dtype=np.float64, count=len(values))
+    except (TypeError, ValueError):
+        v = pd.to_numeric(pd.Series(values), errors="coerce").to_numpy(dtype=np.float64)
+    s["_t"], s["_v"] = t, v
+    return s
+
+
+def series_arrays(s: dict):
+    """(times, values) arrays for a series, normalizing on first use."""
+    if "_v" not in s:
+        normalize_series(s)
+    return s["_t"], s["_v"]
+
+
+def build_combined_df(series_list):
+    """One wide frame (time + one column per variable) over the union of timestamps."""
+    keep = []
+    for s in series_list:
+        t, v = series_arrays(s)
+        if len(t) == 0 or np.isnan(v).all():
+            continue
+        keep.append((s.get("variable","var"), t, v))
+    if not keep:
+        return pd.DataFrame()
+    names = [name for name, _, _ in keep]
+    times0 = keep[0][1]
+    if len(set(names)) == len(names) and all(np.array_equal(t, times0) for _, t, _ in keep[1:]):
+        # common case: Open-Meteo returns every variable on the same hourly axis
+        out = pd.DataFrame({"time": times0})
+        for name, _, v in keep:
+            out[name] = v
+        out = out.dropna(subset=names, how="all")
+    else:
+        # one sorted union of valid timestamps, then a binary-search scatter per series
+        valid = []
+        for name, t, v in keep:
+            ok = ~np.isnan(v) & ~np.isnat(t)
+            valid.append((name, t[ok], v[ok]))
+        all_t = np.unique(np.concatenate([t for _, t, _ in valid]))
+        cols = {}
+        for name, t, v in valid:
+            t, first = np.unique(t, return_index=True)  # duplicate stamps: keep the first sample
+            col = cols.setdefault(name, np.full(all_t.size, np.nan))
+            idx = np.searchsorted(all_t, t)
+            fill = np.isnan(col[idx])  # repeated variable name: earlier series wins
+            col[idx[fill]] = v[first][fill]
+        out = pd.DataFrame({"time": all_t, **cols})
+    out = out.sort_values("time").reset_index(drop=True)
+    return out
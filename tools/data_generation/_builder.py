@@ -0,0 +1,601 @@
+"""
+_builder.py
+-----------
+Sweep machinery shared by make_dataset_full.py and generate_samples.py.
+
+The scripts only differ in what they sweep (places × variable bundles × time
+modes) and in their deterministic writer; both hand those to build(), which
+warms capabilities + geocodes, groups the sweep per place × mode, calls the MCP
+server (resolve → plan → execute) and writes the JSONL records, optionally
+across worker processes.
+"""
+import argparse, asyncio, base64, functools, gzip, hashlib, importlib.util, io, multiprocessing as mp, os, pickle, queue, shutil, sys, threading, time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Any, Callable, List, Optional, Tuple
+import numpy as np
+import requests as rq
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+try:
+    import httpx  # optional: native async client (HTTP/2 when `h2` is installed)
+except Exception:
+    httpx = None
+
+try:
+    import fastjsonschema  # optional: compiles the response schema to plain Python checks
+except Exception:
+    fastjsonschema = None
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from meteo_chat import fastjson
+from meteo_chat.mcp_cache import DEFAULT_PATH as DEFAULT_CACHE_PATH, MCPCache
+
+# identical in every record: one shared object, handed to every record by reference
+SYSTEM_PROMPT = sys.intern(
+  "You are the Weather MCP Writer. Never invent numbers. "
+  "Only use provided MCP JSON to produce a response matching agent/schema/response_schema.json. "
+  "Include citations and limitations; keep language concise."
+)
+
+def combo_indices(n_places: int, n_bundles: int, n_modes: int, n_max: int, shuffle: bool, seed: int) -> np.ndarray:
+    """
+    The places × bundles × modes sweep as flat uint32 indices (no tuple per combo);
+    group_combos() decodes them per place × mode.
+    """
+    idx = np.arange(n_places * n_bundles * n_modes, dtype=np.uint32)
+    if shuffle:
+        np.random.default_rng(seed).shuffle(idx)
+    return idx[:n_max]
+
+def ts_utc() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+# -----------------------------
+# MCP client + request cache
+# -----------------------------
+# transient MCP failures: retried inside the transport, with exponential backoff (factor * 2**k)
+RETRIES, BACKOFF = 4, 1.2
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+class _ThreadedClient:
+    """requests-based stand-in for httpx.AsyncClient: each POST runs in a worker thread."""
+    def __init__(self, base_url: str, timeout: float, pool_size: int):
+        self.base_url, self.timeout = base_url, timeout
+        self._sess = rq.Session()
+        # one keep-alive socket per in-flight combo (requests' default pool keeps only 10)
+        retry = Retry(total=RETRIES, backoff_factor=BACKOFF, status_forcelist=RETRY_STATUS,
+                      allowed_methods=frozenset({"GET", "POST"}), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(10, pool_size), max_retries=retry)
+        self._sess.mount("http://", adapter)
+        self._sess.mount("https://", adapter)
+
+    async def post(self, path: str, json: Dict[str, Any]):
+        return await asyncio.to_thread(self._sess.post, f"{self.base_url}{path}", json=json, timeout=self.timeout)
+
+    async def aclose(self):
+        self._sess.close()
+
+if httpx is not None:
+    class _StatusRetryTransport(httpx.AsyncBaseTransport):
+        """
+        AsyncHTTPTransport(retries=…) only retries failed connects; this adds what urllib3's
+        Retry gives the requests fallback: RETRY_STATUS answers, read timeouts and dropped
+        connections are retried with backoff. The connection pool stays up between attempts.
+        """
+        _RETRY_EXC = (httpx.ReadTimeout, httpx.RemoteProtocolError)
+
+        def __init__(self, inner: "httpx.AsyncBaseTransport"):
+            self._inner = inner
+
+        async def handle_async_request(self, request):
+            for k in range(RETRIES):
+                try:
+                    resp = await self._inner.handle_async_request(request)
+                except self._RETRY_EXC as e:
+                    why = f"{type(e).__name__}: {e}"
+                else:
+                    if resp.status_code not in RETRY_STATUS:
+                        return resp
+                    await resp.aclose()
+                    why = f"HTTP {resp.status_code}"
+                sleep = BACKOFF * 2 ** k
+                print(f"[retry] {request.url.path} attempt {k+1}/{RETRIES} -> {why} (sleep {sleep:.1f}s)", flush=True)
+                await asyncio.sleep(sleep)
+            return await self._inner.handle_async_request(request)
+
+        async def aclose(self):
+            await self._inner.aclose()
+
+def make_client(base: str, concurrency: int):
+    if httpx is None:
+        return _ThreadedClient(base, timeout=180, pool_size=concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    transport = httpx.AsyncHTTPTransport(retries=2, limits=limits,
+                                         http2=importlib.util.find_spec("h2") is not None)
+    return httpx.AsyncClient(base_url=base, timeout=180, transport=_StatusRetryTransport(transport))
+
+async def post_json(client, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    # retries live in the client's transport (see make_client)
+    r = await client.post(path, json=payload)
+    r.raise_for_status()
+    return fastjson.loads(r.content)  # orjson when installed; skips the text decode
+
+def make_cache(args) -> Optional[MCPCache]:
+    """Persistent request-hash cache (shared sqlite with the app); geocodes + capabilities never expire."""
+    if not args.cache:
+        return None
+    ttls = {"/describe_capabilities": float("inf"), "/resolve_location": float("inf"),
+            "/plan_query": 3600, "/execute_plan": args.exec_ttl}
+    return MCPCache(args.cache_path, ttls=ttls)
+
+async def cached_post(client, cache: Optional[MCPCache], path: str, payload: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+    """(body, from_cache). On a miss, POSTs and stores the answer."""
+    if cache is not None:
+        body = cache.get(path, payload)
+        if body is not None:
+            return body, True
+    body = await post_json(client, path, payload)
+    if cache is not None:
+        cache.put(path, payload, body)
+    return body, False
+
+# -----------------------------
+# Rule-based key numbers (no LLM)
+# -----------------------------
+def _as_array(values) -> np.ndarray:
+    """JSON number list -> float64 array in one pass (None -> NaN)."""
+    values = values or []
+    return np.fromiter((np.nan if v is None else v for v in values), dtype=np.float64, count=len(values))
+
+def _fmt(x, unit: str) -> str:
+    # numpy scalars from nanmin/nanmean are floats too: the try only runs for odd inputs
+    if x is None: return "NA"
+    if not isinstance(x, (float, int)):
+        try: x = float(x)
+        except Exception: return "NA"
+    return f"{x:.1f} {unit}" if unit else f"{x:.1f}"
+
+def _clim_numbers(ex: Dict[str,Any], key_numbers: List[str]) -> None:
+    for c in (ex.get("climatologies") or [])[:2]:
+        u = c.get("unit","")
+        lt = c.get("blocks",{}).get("long_term",{})
+        if lt.get("mean") is not None: key_numbers.append(f"{c['variable']} long-term mean: {_fmt(lt['mean'], u)}")
+        if lt.get("p10") is not None and lt.get("p90") is not None: key_numbers.append(f"{c['variable']} p10–p90: {_fmt(lt['p10'], u)}–{_fmt(lt['p90'], u)}")
+        seas = c.get("blocks",{}).get("seasonal",{})
+        if seas.get("mean"):
+            arr = _as_array(seas["mean"])
+            if (~np.isnan(arr)).any(): key_numbers.append(f"{c['variable']} seasonal mean range: {_fmt(np.nanmin(arr), u)}–{_fmt(np.nanmax(arr), u)}")
+        break
+
+def _series_numbers(ex: Dict[str,Any], key_numbers: List[str]) -> None:
+    for s in (ex.get("series") or [])[:2]:
+        u = s.get("unit","")
+        arr = _as_array(s.get("values"))
+        ok = np.flatnonzero(~np.isnan(arr))
+        if ok.size:
+            key_numbers.append(f"{s['variable']} first: {_fmt(arr[ok[0]], u)}")
+            key_numbers.append(f"{s['variable']} mean: {_fmt(np.nanmean(arr), u)}")
+
+def _agg_numbers(ex: Dict[str,Any], key_numbers: List[str]) -> None:
+    for a in (ex.get("aggregates") or [])[:1]:
+        u = a.get("unit","")
+        means = _as_array(a.get("aggregation",{}).get("mean"))
+        if (~np.isnan(means)).any(): key_numbers.append(f"{a['variable']} diurnal mean range: {_fmt(np.nanmin(means), u)}–{_fmt(np.nanmax(means), u)}")
+
+# mode -> (key-number handlers, answer); climatologies win over series, aggregates always add a range
+_HANDLERS = {
+    "clim": ((_clim_numbers, _agg_numbers), "Typical conditions summarized across long-term mean & spread, seasonal (monthly), diurnal (local hour), and spatial bands."),
+    "agg": ((_series_numbers, _agg_numbers), "Regional conditions summarized as mean ± IQR across an adaptive grid."),
+    "series": ((_series_numbers,), "Point conditions summarized from hourly/current series."),
+    "none": ((), "Requested variables were not available; see limitations."),
+}
+
+def _mode_flag(ex: Dict[str,Any]) -> str:
+    return "clim" if ex.get("climatologies") else "agg" if ex.get("aggregates") else "series" if ex.get("series") else "none"
+
+def summarize(ex: Dict[str,Any]) -> Tuple[List[str], str]:
+    """(key numbers, short answer) for an execute_plan answer, both picked by the result kind."""
+    handlers, answer = _HANDLERS[_mode_flag(ex)]
+    key_numbers: List[str] = []
+    for h in handlers: h(ex, key_numbers)
+    return key_numbers[:8], answer
+
+MAX_FIGURES = 4  # same cap as agent_client.assemble_schema_answer
+
+def figures_for(ex: Dict[str,Any], args) -> List[Dict[str,str]]:
+    """
+    Series / aggregate plots for one record: content-addressed PNGs under --figures-dir,
+    referenced by path relative to --out (repeats reuse one file, rendered once), or inline
+    base64 with --inline-figures 1.
+    """
+    from tools.visualization import plot_utils  # matplotlib only when figures are on
+    jobs = []
+    for s in ex.get("series") or []:
+        jobs.append(("series", s["variable"], f"{s['variable']} time series", plot_utils.point_series_png,
+                     (s["variable"], s.get("unit",""), s.get("times", []), s.get("values", []))))
+    for a in ex.get("aggregates") or []:
+        agg = a.get("aggregation", {})
+        jobs.append(("aggregate", a["variable"], f"{a['variable']} mean±IQR (region)", plot_utils.region_aggregate_png,
+                     (a["variable"], a.get("unit",""), agg.get("index", []), agg.get("mean", []), agg.get("iqr", []))))
+    figs = []
+    for kind, var, caption, render, plot_args in jobs[:MAX_FIGURES]:
+        fig = {"variable": var, "caption": caption, "kind": kind}
+        if args.inline_figures:
+            fig["img_b64"] = base64.b64encode(render(*plot_args)).decode("ascii")
+        else:
+            name = hashlib.blake2b(fastjson.dumps([kind, *plot_args]).encode("utf-8"), digest_size=16).hexdigest()
+            path = plot_utils.save_png(args.figures_dir, name, lambda: render(*plot_args))
+            fig["path"] = os.path.relpath(path, os.path.dirname(os.path.abspath(args.out)))
+        figs.append(fig)
+    return figs
+
+# -----------------------------
+# Optional schema validation
+# -----------------------------
+@functools.lru_cache(maxsize=None)
+def _load_schema(schema_path: str) -> Dict[str,Any]:
+    with open(schema_path, "rb") as f:
+        return fastjson.loads(f.read())
+
+@functools.lru_cache(maxsize=None)
+def _schema_validator(schema_path: str):
+    """
+    Callable that raises on an invalid payload, built once per process: fastjsonschema's
+    compiled check when installed, else a jsonschema validator (schema checked once).
+    """
+    schema = _load_schema(schema_path)
+    if fastjsonschema is not None:
+        return fastjsonschema.compile(schema)
+    import jsonschema
+    from jsonschema.exceptions import best_match
+    cls = jsonschema.validators.validator_for(schema)
+    cls.check_schema(schema)
+    validator = cls(schema)
+
+    def check(payload: Dict[str,Any]) -> None:
+        err = best_match(validator.iter_errors(payload))  # same error jsonschema.validate raises
+        if err is not None:
+            raise err
+    return check
+
+def validate_schema(payload: Dict[str,Any], schema_path: str) -> Optional[str]:
+    try:
+        _schema_validator(schema_path)(payload)
+        return None
+    except Exception as e:
+        return str(e)
+
+VALIDATE_ALL_FIRST = 100  # the writer is deterministic: shape errors show up early
+
+def should_validate(i: int, rate: float) -> bool:
+    """Every one of the first VALIDATE_ALL_FIRST records (by ex#), then an even `rate` sample."""
+    return i <= VALIDATE_ALL_FIRST or int(i * rate) != int((i - 1) * rate)
+
+# -----------------------------
+# Buffered JSONL writer
+# -----------------------------
+_enc = fastjson.dumps  # compact; orjson when installed, else one stdlib encoder config
+
+class JsonlWriter:
+    """
+    Background JSONL writer: put() only enqueues; one thread encodes records into
+    a 1 MB buffer and flushes every `flush_every` s or `flush_records` records,
+    whichever comes first. A path ending in .gz is gzip-compressed (level 3).
+    close() drains whatever is still queued before closing the file.
+    """
+    _STOP = object()
+
+    def __init__(self, path: str, total: int, log_every: int, flush_every: float = 0.1, flush_records: int = 256):
+        if path.endswith(".gz"):
+            self._raw = open(path, "wb", buffering=1 << 20)
+            self._f = io.TextIOWrapper(gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=3), encoding="utf-8")
+        else:
+            self._raw = None
+            self._f = open(path, "w", encoding="utf-8", buffering=1 << 20)
+        self.total, self.log_every = total, log_every
+        self.flush_every, self.flush_records = flush_every, flush_records
+        self.count = 0
+        self._q: "queue.Queue" = queue.Queue(maxsize=1024)
+        self._t = threading.Thread(target=self._run, name="jsonl-writer", daemon=True)
+        self._t.start()
+
+    def put(self, record: Dict[str, Any], label: str = "") -> None:
+        self._q.put((record, label))
+
+    def _run(self) -> None:
+        pending, last = 0, time.monotonic()
+        while True:
+            try:
+                item = self._q.get(timeout=self.flush_every)
+            except queue.Empty:
+                item = None
+            if item is self._STOP:
+                break
+            if item is not None:
+                record, label = item
+                self._f.write(_enc(record))
+                self._f.write("\n")
+                self.count += 1
+                pending += 1
+                if self.count % self.log_every == 0:
+                    print(f"[{self.count}/{self.total}] wrote={self.count} :: {label}", flush=True)
+            if pending and (pending >= self.flush_records or time.monotonic() - last >= self.flush_every):
+                self._f.flush()
+                pending, last = 0, time.monotonic()
+        self._f.flush()
+
+    def close(self) -> int:
+        self._q.put(self._STOP)
+        self._t.join()
+        self._f.close()
+        if self._raw is not None:
+            self._raw.close()
+        return self.count
+
+# -----------------------------
+# Geocode warm-up (Nominatim-backed)
+# -----------------------------
+GEOCODE_RPS = 1 / 1.1  # Nominatim policy is ≤1 request/s; keep the old 1.1 s margin
+GEOCODE_WORKERS = 10
+
+class RateLimiter:
+    """Spaces callers at least 1/rate s apart; only hit when a call actually goes to MCP."""
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self.next_ok = 0.0
+        self.calls = 0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            dt = self.next_ok - time.monotonic()
+            if dt > 0:
+                await asyncio.sleep(dt)
+            self.next_ok = time.monotonic() + self.interval
+            self.calls += 1
+
+async def resolve_place(client, cache: Optional[MCPCache], place: str, limiter: RateLimiter) -> Dict[str,Any]:
+    """/resolve_location for one place; only a cache miss waits on the limiter."""
+    payload = {"query": place}
+    loc = None if cache is None else cache.get("/resolve_location", payload)
+    if loc is None:
+        await limiter.wait()
+        loc = await post_json(client, "/resolve_location", payload)
+        if cache is not None:
+            cache.put("/resolve_location", payload, loc)
+    return loc
+
+async def resolve_places(client, cache: Optional[MCPCache], places: List[str], limiter: RateLimiter) -> None:
+    """Warm /resolve_location for every place. Cache hits return at once; misses queue on the limiter."""
+    todo: asyncio.Queue = asyncio.Queue()
+    for p in places:
+        todo.put_nowait(p)
+    done = 0
+
+    async def worker():
+        nonlocal done
+        while True:
+            try:
+                p = todo.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                await resolve_place(client, cache, p, limiter)
+            except Exception as e:
+                print(f"[geocode-skip] {p} -> {e}", flush=True)
+            done += 1
+            if done % 10 == 0:
+                print(f"[geocode] {done}/{len(places)} done", flush=True)
+
+    await asyncio.gather(*(worker() for _ in range(min(GEOCODE_WORKERS, len(places)))))
+
+# -----------------------------
+# Sweep: place × mode groups
+# -----------------------------
+def group_combos(combos: np.ndarray, places: tuple, bundles: tuple, modes: tuple):
+    """
+    Regroup the sweep per place × mode: [(place, mode, [(ex#, bundle), ...]), ...]
+    in the order each group first shows up, so one execute call can serve the group.
+    """
+    nb, nm = len(bundles), len(modes)
+    groups: Dict[tuple, list] = {}
+    for i, c in enumerate(combos.tolist(), 1):
+        groups.setdefault((c // (nb * nm), c % nm), []).append((i, bundles[(c // nm) % nb]))
+    return [(places[p], modes[m], members) for (p, m), members in groups.items()]
+
+def _om_vars(plan: Dict[str,Any]) -> List[str]:
+    # the variables executePlan actually fetches for a plan
+    return [it["canonical"] for it in plan.get("items", []) if it.get("canonical") and it.get("provider") == "open-meteo"]
+
+def _exec_key(plan: Dict[str,Any]) -> str:
+    # plans that only differ in their items can share one execute call
+    return fastjson.dumps({k: plan.get(k) for k in ("place_geometry", "time_mode", "options")}, sort_keys=True)
+
+def merge_plans(plans: List[Dict[str,Any]]) -> Dict[str,Any]:
+    """One plan over the union of the plans' Open-Meteo variables (same geometry / mode / options)."""
+    items, seen = [], set()
+    for plan in plans:
+        for it in plan.get("items", []):
+            v = it.get("canonical")
+            if v and it.get("provider") == "open-meteo" and v not in seen:
+                seen.add(v)
+                items.append(it)
+    return {**plans[0], "items": items}
+
+def slice_execute(ex: Dict[str,Any], plan: Dict[str,Any]) -> Dict[str,Any]:
+    """The part of a merged execute_plan answer that `plan` would have gotten on its own."""
+    vs = _om_vars(plan)
+    out = dict(ex)
+    for k in ("series", "climatologies", "aggregates"):
+        if ex.get(k) is not None:
+            by_var = {e.get("variable"): e for e in ex[k]}
+            out[k] = [by_var[v] for v in vs if v in by_var]
+    return out
+
+# the script's deterministic writer: (place, time_mode, plan, execute_result, ts) -> output record
+Writer = Callable[[str, str, Dict[str,Any], Dict[str,Any], str], Dict[str,Any]]
+
+async def process_group(client, sem, limiter: RateLimiter, place: str, mode: str, members: List[tuple],
+                        caps: Dict[str,Any], cache: Optional[MCPCache], args, write: Writer, writer: JsonlWriter):
+    """
+    resolve once → plan per bundle → one execute per distinct plan shape → a record per
+    combo, sliced back out of the merged answer and handed to the writer thread.
+    """
+    async with sem:
+        try:
+            # warmed in prepare(); a miss (failed warm-up, --cache 0) still goes through the limiter
+            loc = await resolve_place(client, cache, place, limiter)
+        except Exception as e:
+            for i, vars_bundle in members:
+                print(f"[skip {i}] {place} | {vars_bundle} | {mode} -> {e}", flush=True)
+            return
+        geom = {"type":"Point","lat":loc["lat"],"lon":loc["lon"]} if loc["area_km2"] < 5e4 else {"type":"BBox","bbox":loc["bbox"]}
+
+        # planning stays per bundle: the server may switch the mode on the bundle's variables
+        plans = await asyncio.gather(*(cached_post(client, cache, "/plan_query", {"capabilities": caps,"place_geometry": geom,"time_mode": mode,"variables": vars_bundle})
+                                       for _, vars_bundle in members), return_exceptions=True)
+        shapes: Dict[str, list] = {}
+        for (i, vars_bundle), res in zip(members, plans):
+            if isinstance(res, BaseException):
+                print(f"[skip {i}] {place} | {vars_bundle} | {mode} -> {res}", flush=True)
+            else:
+                shapes.setdefault(_exec_key(res[0]), []).append((i, vars_bundle, res[0]))
+
+        for entries in shapes.values():
+            try:
+                ex_all, _ = await cached_post(client, cache, "/execute_plan", {"plan": merge_plans([p for _, _, p in entries])})
+            except Exception as e:
+                for i, vars_bundle, _ in entries:
+                    print(f"[skip {i}] {place} | {vars_bundle} | {mode} -> {e}", flush=True)
+                continue
+            for i, vars_bundle, plan in entries:
+                try:
+                    ex = slice_execute(ex_all, plan)
+                    now = ts_utc()
+                    rec_in = {"place": place,"time_mode": mode,"plan": plan,"execute_result": ex,"timestamp_utc": now}
+                    rec_out = write(place, mode, plan, ex, now)
+                    if args.figures_dir or args.inline_figures:
+                        rec_out["figures"] = await asyncio.to_thread(figures_for, ex, args)  # renders off the event loop
+                    if args.validate and should_validate(i, args.validate_rate):
+                        err = validate_schema(rec_out, args.schema_path)
+                        if err: print(f"[warn schema] ex#{i} {place} {vars_bundle} {mode} -> {err}", flush=True)
+                    writer.put({"system": SYSTEM_PROMPT,"input": rec_in,"output": rec_out}, f"{place} | {vars_bundle} | {mode}")
+                except Exception as e:
+                    print(f"[skip {i}] {place} | {vars_bundle} | {mode} -> {e}", flush=True)
+        await asyncio.sleep(args.sleep)
+
+async def prepare(args, places: List[str]) -> Dict[str,Any]:
+    """Capabilities + geocode warm-up, once in the parent before the sweep is split up."""
+    client = make_client(args.mcp, GEOCODE_WORKERS)
+    cache = make_cache(args)
+    try:
+        try:
+            caps, _ = await cached_post(client, cache, "/describe_capabilities", {})
+        except Exception as e:
+            raise SystemExit(f"Failed to reach MCP: {e}")
+
+        # Pre-resolve unique places into the cache: workers in parallel, MCP calls (cache misses) at ≤1 rps
+        print(f"[geocode] resolving {len(places)} places…", flush=True)
+        limiter = RateLimiter(GEOCODE_RPS)
+        await resolve_places(client, cache, places, limiter)
+        print(f"[geocode] done: {limiter.calls} MCP calls, {len(places) - limiter.calls} cache hits", flush=True)
+        return caps
+    finally:
+        await client.aclose()
+
+async def run(args, caps: Dict[str,Any], groups: List[tuple], out: str, total: int, write: Writer, log_every: int) -> int:
+    client = make_client(args.mcp, args.concurrency)
+    cache = make_cache(args)
+    try:
+        # K place × mode groups in flight, one execute call per group; records go to one background writer thread
+        sem = asyncio.Semaphore(max(1, args.concurrency))
+        limiter = RateLimiter(GEOCODE_RPS)
+        writer = JsonlWriter(out, total=total, log_every=log_every)
+        try:
+            await asyncio.gather(*(process_group(client, sem, limiter, place, mode, members, caps, cache, args, write, writer)
+                                   for place, mode, members in groups),
+                                 return_exceptions=True)
+        finally:
+            wrote = writer.close()  # drains the queue, also on Ctrl+C
+        return wrote
+    finally:
+        await client.aclose()
+
+_worker_caps: Optional[Dict[str,Any]] = None
+
+def _init_worker(caps_blob: bytes) -> None:
+    global _worker_caps
+    _worker_caps = pickle.loads(caps_blob)
+
+def _run_shard(job) -> int:
+    # own event loop, client and sqlite connection per process
+    args, groups, out, total, write, log_every = job
+    return asyncio.run(run(args, _worker_caps, groups, out, total, write, log_every))
+
+def shard_path(out: str, i: int) -> str:
+    # keep .gz last so shards are compressed too; gzip members concatenate into one valid stream
+    base, ext = (out[:-3], ".gz") if out.endswith(".gz") else (out, "")
+    return f"{base}.shard{i}{ext}"
+
+def run_sharded(args, caps: Dict[str,Any], groups: List[tuple], workers: int, write: Writer, log_every: int) -> int:
+    """
+    Contiguous chunks of groups → one process each, writing its own shard; shards are
+    concatenated into args.out at the end. --concurrency is split across the workers.
+    """
+    size = -(-len(groups) // workers)
+    wargs = argparse.Namespace(**{**vars(args), "concurrency": max(1, args.concurrency // workers)})
+    jobs = []
+    for i in range(workers):
+        part = groups[i * size:(i + 1) * size]
+        if part:
+            jobs.append((wargs, part, shard_path(args.out, i), sum(len(m) for _, _, m in part), write, log_every))
+    with mp.Pool(len(jobs), initializer=_init_worker, initargs=(pickle.dumps(caps),)) as pool:
+        wrote = sum(pool.map(_run_shard, jobs, chunksize=1))
+    with open(args.out, "wb") as f_out:
+        for _, _, path, *_ in jobs:
+            with open(path, "rb") as f_in:
+                shutil.copyfileobj(f_in, f_out, 1 << 20)
+            os.remove(path)
+    return wrote
+
+# -----------------------------
+# CLI
+# -----------------------------
+def add_arguments(ap: argparse.ArgumentParser, max_default: int, sleep_default: float) -> None:
+    """The flags both builders share; only the --max / --sleep defaults differ."""
+    ap.add_argument("--mcp", default="http://127.0.0.1:8787")
+    ap.add_argument("--out", default="data/train_full.jsonl", help="JSONL path; a .gz suffix writes gzip")
+    ap.add_argument("--max", type=int, default=max_default, help="cap total examples")
+    ap.add_argument("--shuffle", type=int, default=1)
+    ap.add_argument("--seed", type=int, default=13)
+    ap.add_argument("--sleep", type=float, default=sleep_default, help="sleep between groups (per in-flight slot)")
+    ap.add_argument("--concurrency", type=int, default=16, help="place × mode groups in flight against the MCP server (total, split across --workers)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes, each sweeping a contiguous shard of the groups")
+    ap.add_argument("--validate", type=int, default=1, help="validate against agent/schema/response_schema.json")
+    ap.add_argument("--validate-rate", type=float, default=0.1, help=f"fraction of records validated after the first {VALIDATE_ALL_FIRST} (1 = all)")
+    ap.add_argument("--figures-dir", default="", help="render series/aggregate plots to this dir (content-addressed PNGs) and reference them by path")
+    ap.add_argument("--inline-figures", type=int, default=0, help="embed the plots as base64 in each record instead")
+    ap.add_argument("--cache", type=int, default=1, help="persist MCP answers across runs (request-hash keyed)")
+    ap.add_argument("--cache-path", default=DEFAULT_CACHE_PATH)
+    ap.add_argument("--exec-ttl", type=float, default=900, help="seconds an /execute_plan answer stays fresh")
+
+def build(args, places: tuple, bundles: tuple, modes: tuple, write: Writer, log_every: int) -> int:
+    """Sweep places × bundles × modes into args.out; returns the number of records written."""
+    os.makedirs(os.path.dirname(args.out), exist_ok=True)
+    args.schema_path = os.path.join("agent","schema","response_schema.json")
+    if args.figures_dir:
+        os.makedirs(args.figures_dir, exist_ok=True)
+
+    combos = combo_indices(len(places), len(bundles), len(modes), args.max, bool(args.shuffle), args.seed)
+    groups = group_combos(combos, places, bundles, modes)
+    caps = asyncio.run(prepare(args, sorted({place for place, _, _ in groups})))
+    workers = max(1, min(args.workers, len(groups)))
+    print(f"[batch] {len(combos)} combos in {len(groups)} place × mode groups, {workers} worker(s)", flush=True)
+    if workers > 1:
+        return run_sharded(args, caps, groups, workers, write, log_every)
+    return asyncio.run(run(args, caps, groups, args.out, len(combos), write, log_every))
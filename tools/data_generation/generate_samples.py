@@ -22,16 +22,20 @@ Tip: start MCP in another terminal:
   cd mcp_server && npm i && npm run dev
 """
 
-import argparse, json, os, random, time
-from datetime import datetime, timezone
-from typing import Dict, Any, List, Optional
+import argparse, functools, sys
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
 
-import requests as rq
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from tools.data_generation._builder import add_arguments, build, summarize, ts_utc
 
 # -----------------------------
 # 1) Expanded PLACES (≈150)
 # -----------------------------
-DEFAULT_PLACES = [
+DEFAULT_PLACES = (
     # --- Asia ---
     "Tokyo","Kyoto","Osaka","Sapporo","Seoul","Busan",
     "Beijing","Shanghai","Guangzhou","Hong Kong","Shenzhen",
@@ -83,12 +87,12 @@ DEFAULT_PLACES = [
     "Indonesia","Japan","South Korea","Saudi Arabia","South Africa",
     "Egypt","Nigeria","Argentina","Chile","Mexico","United Kingdom",
     "France","Germany","Italy","Spain","Norway","Kenya","Ethiopia","Morocco"
-]
+)
 
 # ------------------------------------
 # 2) Variable bundles (≈40, with aliases)
 # ------------------------------------
-VARIABLE_BUNDLES = [
+VARIABLE_BUNDLES = (
     # Core weather
     ["temperature"], ["temperature","typical"], ["air temp","daily average"],
     ["winds"], ["wind speed","gusts"], ["winds","clouds","rainfall"],
@@ -122,196 +126,60 @@ VARIABLE_BUNDLES = [
 
     # Unsupported to teach clean fallback behavior
     ["air quality","PM2.5"], ["ozone","pollution"], ["sea ice","extent"],
-]
-
-TIME_MODES = ["forecast","historical","current"]
-
-SYSTEM_PROMPT = (
-  "You are the Weather MCP Writer. Never invent numbers. "
-  "Only use provided MCP JSON to produce a response matching agent/schema/response_schema.json. "
-  "Include citations and limitations; keep language concise."
 )
 
-def ts_utc() -> str:
-    return datetime.now(timezone.utc).isoformat()
+TIME_MODES = ("forecast","historical","current")
 
-def post_json(base: str, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-    r = rq.post(f"{base}{path}", json=payload, timeout=180)
-    r.raise_for_status()
-    return r.json()
+# identical in every record: one shared object, handed to every record by reference
+SUGGESTED_FOLLOWUPS = [sys.intern(s) for s in (
+    "Switch between forecast/current/historical to compare.",
+    "Add humidity and wind gusts for heat/comfort context.",
+)]
 
 # -----------------------------
 # Rule-based deterministic writer (no LLM)
 # -----------------------------
-def writer_from_execute(place: str, time_mode: str, plan: Dict[str,Any], ex: Dict[str,Any]) -> Dict[str,Any]:
-    # Title
-    vars_planned = [it.get("canonical") for it in plan.get("items", []) if it.get("canonical")]
-    title = f"{place} — " + (", ".join([v for v in vars_planned if v][:3]) + ("…" if len(vars_planned)>3 else ""))
-
-    # Key numbers (conservative)
-    key_numbers: List[str] = []
-    def fmt(x, unit):
-        if x is None: return "NA"
-        try: return f"{float(x):.1f} {unit}" if unit else f"{float(x):.1f}"
-        except: return "NA"
-
-    # Prefer climatologies → long-term & seasonal/diurnal ranges
-    if ex.get("climatologies"):
-        for c in ex["climatologies"][:2]:
-            u = c.get("unit","")
-            lt = c.get("blocks",{}).get("long_term",{})
-            if lt.get("mean") is not None:
-                key_numbers.append(f"{c['variable']} long-term mean: {fmt(lt['mean'], u)}")
-            if lt.get("p10") is not None and lt.get("p90") is not None:
-                key_numbers.append(f"{c['variable']} p10–p90: {fmt(lt['p10'], u)}–{fmt(lt['p90'], u)}")
-            seas = c.get("blocks",{}).get("seasonal",{})
-            if seas.get("mean"):
-                import math
-                vals = [v for v in seas["mean"] if v is not None]
-                if vals:
-                    key_numbers.append(f"{c['variable']} seasonal mean range: {fmt(min(vals), u)}–{fmt(max(vals), u)}")
-            break
-
-    elif ex.get("series"):
-        for s in ex["series"][:2]:
-            u = s.get("unit","")
-            vals = [v for v in s.get("values",[]) if v is not None]
-            if vals:
-                key_numbers.append(f"{s['variable']} first: {fmt(vals[0], u)}")
-                key_numbers.append(f"{s['variable']} mean: {fmt(sum(vals)/len(vals), u)}")
+@functools.lru_cache(maxsize=256)
+def _bundle_strings(canon: Tuple[str, ...]) -> Tuple[str, str]:
+    # (title suffix, method) depend only on the planned variables, which recur across places × modes
+    title_suffix = ", ".join(canon[:3]) + ("…" if len(canon) > 3 else "")
+    method = (
+      f"Open-Meteo first. Planned variables: {', '.join(canon)}. "
+      "Regions use adaptive grid → mean ± IQR. Historical mode computes lightweight climatology "
+      "from a recent full year of hourly archive."
+    )
+    return title_suffix, method
 
-    if ex.get("aggregates"):
-        for a in ex["aggregates"][:1]:
-            u = a.get("unit","")
-            means = [v for v in a.get("aggregation",{}).get("mean",[]) if v is not None]
-            if means:
-                key_numbers.append(f"{a['variable']} diurnal mean range: {fmt(min(means), u)}–{fmt(max(means), u)}")
+def writer_from_execute(place: str, time_mode: str, plan: Dict[str,Any], ex: Dict[str,Any], ts: Optional[str] = None) -> Dict[str,Any]:
+    # Title
+    title_suffix, method = _bundle_strings(tuple(it["canonical"] for it in plan.get("items", []) if it.get("canonical")))
+    title = f"{place} — {title_suffix}"
 
-    # Answer text (short)
-    if ex.get("climatologies"):
-        answer = ("Typical conditions summarized across long-term mean & spread, "
-                  "seasonal (monthly), diurnal (local hour), and spatial bands.")
-    elif ex.get("aggregates"):
-        answer = "Regional conditions summarized as mean ± IQR across an adaptive grid."
-    elif ex.get("series"):
-        answer = "Point conditions summarized from hourly/current series."
-    else:
-        answer = "Requested variables were not available; see limitations."
+    # Key numbers (conservative) + short answer text, both picked by the result kind
+    key_numbers, answer = summarize(ex)
 
     figures = []  # Keep empty here; Streamlit and tools can attach plots later.
 
-    method = (
-      f"Open-Meteo first. Planned variables: {', '.join([v for v in vars_planned if v])}. "
-      f"Regions use adaptive grid → mean ± IQR. Historical mode computes lightweight climatology "
-      f"from a recent full year of hourly archive."
-    )
-
-    citations = list(ex.get("citations", [])) + [f"Query timestamp: {ts_utc()}"]
+    citations = list(ex.get("citations", [])) + [f"Query timestamp: {ts or ts_utc()}"]
     limitations = ex.get("limitations", []) or ["Model output; station validation not applied."]
 
-    suggested = ["Switch between forecast/current/historical to compare.",
-                 "Add humidity and wind gusts for heat/comfort context."]
-
     return {
         "title": title,
         "answer": answer,
-        "key_numbers": key_numbers[:8],
+        "key_numbers": key_numbers,
         "figures": figures,
         "method": method,
         "citations": citations,
         "limitations": limitations,
-        "suggested_followups": suggested[:5]
+        "suggested_followups": SUGGESTED_FOLLOWUPS
     }
 
-# -----------------------------
-# Optional schema validation
-# -----------------------------
-def validate_schema(payload: Dict[str,Any], schema_path: str) -> Optional[str]:
-    try:
-        import jsonschema
-        with open(schema_path, "r", encoding="utf-8") as f:
-            schema = json.load(f)
-        jsonschema.validate(payload, schema)
-        return None
-    except Exception as e:
-        return str(e)
-
-# -----------------------------
-# Main loop
-# -----------------------------
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--mcp", default="http://127.0.0.1:8787")
-    ap.add_argument("--out", default="data/train_full.jsonl")
-    ap.add_argument("--max", type=int, default=2500, help="cap total examples")
-    ap.add_argument("--shuffle", type=int, default=1)
-    ap.add_argument("--seed", type=int, default=13)
-    ap.add_argument("--sleep", type=float, default=0.2)
-    ap.add_argument("--validate", type=int, default=1, help="validate against agent/schema/response_schema.json")
+    add_arguments(ap, max_default=2500, sleep_default=0.2)
     args = ap.parse_args()
-
-    os.makedirs(os.path.dirname(args.out), exist_ok=True)
-    random.seed(args.seed)
-
-    # Build Cartesian product
-    combos = [(p, vb, tm) for p in DEFAULT_PLACES for vb in VARIABLE_BUNDLES for tm in TIME_MODES]
-    if args.shuffle: random.shuffle(combos)
-    combos = combos[:args.max]
-
-    # warm up capabilities
-    try:
-        caps = post_json(args.mcp, "/describe_capabilities", {})
-    except Exception as e:
-        raise SystemExit(f"Failed to reach MCP: {e}")
-
-    schema_path = os.path.join("agent","schema","response_schema.json")
-
-    written = 0
-    with open(args.out, "w", encoding="utf-8") as w:
-        for i, (place, vars_bundle, mode) in enumerate(combos, 1):
-            try:
-                loc = post_json(args.mcp, "/resolve_location", {"query": place})
-                geom = {"type":"Point","lat":loc["lat"],"lon":loc["lon"]} if loc["area_km2"] < 5e4 else {"type":"BBox","bbox":loc["bbox"]}
-
-                plan = post_json(args.mcp, "/plan_query", {
-                    "capabilities": caps,
-                    "place_geometry": geom,
-                    "time_mode": mode,
-                    "variables": vars_bundle
-                })
-
-                ex = post_json(args.mcp, "/execute_plan", {"plan": plan})
-
-                rec_in = {
-                    "place": place,
-                    "time_mode": mode,
-                    "plan": plan,
-                    "execute_result": ex,
-                    "timestamp_utc": ts_utc()
-                }
-                rec_out = writer_from_execute(place, mode, plan, ex)
-
-                if args.validate:
-                    err = validate_schema(rec_out, schema_path)
-                    if err:  # keep building, just log it
-                        print(f"[warn schema] ex#{i} {place} {vars_bundle} {mode} -> {err}")
-
-                record = {
-                    "system": SYSTEM_PROMPT,
-                    "input": rec_in,
-                    "output": rec_out
-                }
-                w.write(json.dumps(record, ensure_ascii=False) + "\n")
-                written += 1
-
-                if i % 50 == 0:
-                    print(f"[{i}/{len(combos)}] wrote={written} :: {place} | {vars_bundle} | {mode}")
-
-            except Exception as e:
-                print(f"[skip {i}] {place} | {vars_bundle} | {mode} -> {e}")
-            time.sleep(args.sleep)
-
+    written = build(args, DEFAULT_PLACES, VARIABLE_BUNDLES, TIME_MODES, writer_from_execute, log_every=50)
     print(f"✅ Done. Wrote {written} examples to {args.out}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
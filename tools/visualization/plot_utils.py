@@ -1,59 +1,137 @@
 """
 plot_utils.py
 -------------
-Generate tiny (<200 KB) PNG plots in base64 for:
+Generate tiny (<200 KB) PNG plots, in base64 or as raw bytes, for:
 - point time series (times, values)
 - regional aggregates (index, mean, iqr)
 
+save_png() writes one to a figures dir instead, content-addressed, so dataset
+records can carry a path rather than inline base64.
+
 No seaborn. Single-axis matplotlib only.
 """
-from typing import Dict, Any, List, Optional
-import io, base64
-import matplotlib.pyplot as plt
+from typing import Dict, Any, Callable, List, Optional
+import io, base64, os, threading
+import matplotlib
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import numpy as np
-from PIL import Image
 
-def _png_b64_from_fig(fig, max_kb: int = 200) -> str:
+try:
+    import oxipng  # optional (pyoxipng): lossless recompression, tried before any resize
+except Exception:
+    oxipng = None
+
+# collapse near-collinear segments on long series; scoped per render, global rcParams untouched
+_RC = {"path.simplify_threshold": 1.0}
+
+_local = threading.local()
+
+def _get_axes(size=(6, 2.8)):
+    """One pyplot-free Figure/Axes per thread, cleared between plots instead of rebuilt."""
+    if getattr(_local, "fig", None) is None:
+        fig = Figure(figsize=size)
+        FigureCanvasAgg(fig)
+        _local.fig, _local.ax = fig, fig.add_subplot(111)
+    _local.ax.clear()
+    return _local.fig, _local.ax
+
+# PNG bytes per pixel for these single-line plots (mostly flat background): sizes the dpi up front
+PNG_BYTES_PER_PIXEL = 0.4
+
+def _dpi_for(fig, max_kb: int, lo: float = 60, hi: float = 120) -> float:
+    w_in, h_in = fig.get_size_inches()
+    target_pixels = max_kb * 1024 / PNG_BYTES_PER_PIXEL
+    return float(np.clip((target_pixels / (w_in * h_in)) ** 0.5, lo, hi))
+
+def _png_bytes_from_fig(fig, max_kb: int = 200) -> bytes:
     buf = io.BytesIO()
     fig.tight_layout()
-    fig.savefig(buf, format="png", dpi=120, bbox_inches="tight")
-    plt.close(fig)
-    # compress if too big
+    # render at a dpi predicted to fit; no Software/metadata chunk
+    dpi = _dpi_for(fig, max_kb)
+    fig.savefig(buf, format="png", dpi=dpi, bbox_inches="tight", metadata={"Software": None})
     data = buf.getvalue()
     if len(data) > max_kb * 1024:
-        # downscale using PIL
+        # denser than predicted: one re-render at the dpi the measured size implies (pixels ∝ dpi²)
+        buf = io.BytesIO()
+        dpi = max(40.0, 0.95 * dpi * ((max_kb * 1024) / len(data)) ** 0.5)
+        fig.savefig(buf, format="png", dpi=dpi, bbox_inches="tight", metadata={"Software": None})
+        data = buf.getvalue()
+    if len(data) > max_kb * 1024 and oxipng is not None:
+        # same pixels, better deflate: often enough on its own
+        data = oxipng.optimize_from_memory(data, level=2, strip=oxipng.StripChunks.safe())
+    if len(data) > max_kb * 1024:
+        # still too big (floor dpi): downscale using PIL
+        from PIL import Image
         im = Image.open(io.BytesIO(data)).convert("RGB")
         w, h = im.size
         scale = min(1.0, (max_kb * 1024) / len(data)) ** 0.5  # heuristic
         new = im.resize((max(200, int(w * scale)), max(120, int(h * scale))), Image.BILINEAR)
         out = io.BytesIO()
-        new.save(out, format="PNG", optimize=True)
+        new.save(out, format="PNG", optimize=oxipng is None)
         data = out.getvalue()
-    return base64.b64encode(data).decode("ascii")
+        if oxipng is not None:
+            data = oxipng.optimize_from_memory(data, level=2, strip=oxipng.StripChunks.safe())
+    return data
 
-def plot_point_series(variable: str, unit: str, times: List[str], values: List[Optional[float]]) -> str:
-    x = np.array(pd_to_datetime(times))
-    y = np.array([np.nan if v is None else v for v in values], dtype=float)
-    fig, ax = plt.subplots(figsize=(6, 2.8))
+def _png_b64_from_fig(fig, max_kb: int = 200) -> str:
+    return base64.b64encode(_png_bytes_from_fig(fig, max_kb)).decode("ascii")
+
+def _to_arr(vs) -> np.ndarray:
+    # None -> NaN straight into a float64 buffer (no intermediate list); matplotlib leaves NaN as gaps
+    vs = vs or []
+    return np.fromiter((np.nan if v is None else v for v in vs), dtype=np.float64, count=len(vs))
+
+@matplotlib.rc_context(_RC)
+def point_series_png(variable: str, unit: str, times: List[str], values: List[Optional[float]]) -> bytes:
+    x = pd_to_datetime(times)
+    y = _to_arr(values)
+    fig, ax = _get_axes()
     ax.plot(x, y)
     ax.set_title(f"{variable} ({unit})")
     ax.set_xlabel("time")
     ax.set_ylabel(unit)
-    return _png_b64_from_fig(fig)
+    return _png_bytes_from_fig(fig)
 
-def plot_region_aggregate(variable: str, unit: str, index: List[int], mean: List[Optional[float]], iqr: List[Optional[float]]) -> str:
+@matplotlib.rc_context(_RC)
+def region_aggregate_png(variable: str, unit: str, index: List[int], mean: List[Optional[float]], iqr: List[Optional[float]]) -> bytes:
     x = np.array(index)
-    m = np.array([np.nan if v is None else v for v in mean], dtype=float)
-    q = np.array([0 if v is None else v for v in iqr], dtype=float)
-    fig, ax = plt.subplots(figsize=(6, 2.8))
+    m = _to_arr(mean)
+    q = _to_arr(iqr)
+    q[np.isnan(q)] = 0.0
+    fig, ax = _get_axes()
     ax.plot(x, m)
-    ax.fill_between(x, m - q/2, m + q/2, alpha=0.2)
+    half = 0.5 * q
+    ax.fill_between(x, m - half, m + half, alpha=0.2)
     ax.set_title(f"{variable} ({unit})")
     ax.set_xlabel("index")
     ax.set_ylabel(unit)
-    return _png_b64_from_fig(fig)
+    return _png_bytes_from_fig(fig)
+
+def plot_point_series(variable: str, unit: str, times: List[str], values: List[Optional[float]]) -> str:
+    return base64.b64encode(point_series_png(variable, unit, times, values)).decode("ascii")
+
+def plot_region_aggregate(variable: str, unit: str, index: List[int], mean: List[Optional[float]], iqr: List[Optional[float]]) -> str:
+    return base64.b64encode(region_aggregate_png(variable, unit, index, mean, iqr)).decode("ascii")
+
+def save_png(out_dir: str, name: str, render: Callable[[], bytes]) -> str:
+    """
+    Write render() to out_dir/name.png and return the path. `name` should hash the
+    plot inputs: when the file already exists the plot is not rendered again.
+    """
+    path = os.path.join(out_dir, f"{name}.png")
+    if not os.path.exists(path):
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(render())
+        os.replace(tmp, path)  # atomic: concurrent writers of the same figure never leave a torn file
+    return path
 
 # small helper (no pandas dependency)
-def pd_to_datetime(times: List[str]):
-    from datetime import datetime
-    return [datetime.fromisoformat(t.replace("Z","")) for t in times]
\ No newline at end of file
+def pd_to_datetime(times: List[str]) -> np.ndarray:
+    """ISO-8601 strings -> datetime64[s], parsed in C; a trailing Z is dropped (naive UTC)."""
+    try:
+        return np.char.rstrip(np.asarray(times, dtype=str), "Z").astype("datetime64[s]")
+    except ValueError:  # e.g. explicit +hh:mm offsets, which numpy does not parse
+        from datetime import datetime
+        return np.array([datetime.fromisoformat(t.replace("Z","")) for t in times])